@@ -0,0 +1,66 @@
+def min_cost_assignment(costs):
+    # Hungarian algorithm for a rectangular cost matrix with no more rows than columns. Returns the
+    # column assigned to each row so that the total cost is minimal, in O(rows^2 * columns)
+    n = len(costs)
+    if n == 0:
+        return []
+    m = len(costs[0])
+    inf = float("inf")
+    u = [0] * (n + 1)                                  # Row potentials
+    v = [0] * (m + 1)                                  # Column potentials
+    col_row = [0] * (m + 1)                            # Row matched to each column, 1-based, 0 if none
+    way = [0] * (m + 1)
+
+    for row in range(1, n + 1):
+        col_row[0] = row
+        col = 0
+        min_slack = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[col] = True
+            i = col_row[col]
+            row_costs = costs[i - 1]
+            delta = inf
+            next_col = 0
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                slack = row_costs[j - 1] - u[i] - v[j]
+                if slack < min_slack[j]:
+                    min_slack[j] = slack
+                    way[j] = col
+                if min_slack[j] < delta:
+                    delta = min_slack[j]
+                    next_col = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[col_row[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            col = next_col
+            if col_row[col] == 0:
+                break
+        while col != 0:                                # Flip the augmenting path
+            prev = way[col]
+            col_row[col] = col_row[prev]
+            col = prev
+
+    assignment = [None] * n
+    for j in range(1, m + 1):
+        if col_row[j] != 0:
+            assignment[col_row[j] - 1] = j - 1
+    return assignment
+
+
+def assign_to_targets(sources, targets, dist):
+    # Matches each source to a distinct target minimising the total dist. When there are fewer targets
+    # than sources, the sources left over are the ones that are furthest out. Returns {source: target}
+    if len(sources) == 0 or len(targets) == 0:
+        return {}
+    costs = [[dist(source, target) for target in targets] for source in sources]
+    if len(sources) <= len(targets):
+        return {source: targets[j] for source, j in zip(sources, min_cost_assignment(costs))}
+
+    transposed = [list(col) for col in zip(*costs)]
+    return {sources[i]: target for target, i in zip(targets, min_cost_assignment(transposed))}
@@ -0,0 +1,47 @@
+from collections import deque
+import numpy as np
+from DistanceField import DistanceField
+
+class BuildSites:
+    # Cells a city tile can be built on (no resource, no city tile), shared by every worker for the turn.
+    # The nearest one to any position comes from a single DistanceField over all of them, built on first use
+    def __init__(self, game_map):
+        self.update(game_map)
+
+    def update(self, game_map):
+        self.game_map = game_map
+        self.empty_mask = game_map.empty_mask()        # [y, x], True where a city tile can be built
+        self.empty = self.empty_mask.tolist()          # Same as nested lists, for per-cell lookups
+        self._field = None
+
+    def is_empty(self, pos):
+        return self.empty[pos.y][pos.x]
+
+    def get_field(self):
+        if self._field is None:
+            ys, xs = np.nonzero(self.empty_mask)
+            grid = self.game_map.positions.grid
+            sources = [(grid[y][x], grid[y][x]) for x, y in zip(xs.tolist(), ys.tolist())]
+            self._field = DistanceField(self.game_map.positions, sources)
+        return self._field
+
+    def nearest(self, loc):
+        # Closest buildable cell to loc, None if there are none left
+        return self.get_field().target(loc)
+
+    def nearest_k(self, loc, count):
+        # Up to count buildable cells in order of distance from loc
+        neighbours = self.game_map.positions.neighbours
+        found = []
+        searched = {loc}
+        q = deque([loc])
+
+        while len(q) > 0 and len(found) < count:
+            p = q.popleft()
+            if self.is_empty(p):
+                found.append(p)
+            for neighbor in neighbours[p]:
+                if neighbor not in searched:
+                    searched.add(neighbor)
+                    q.append(neighbor)
+        return found
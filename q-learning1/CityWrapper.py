@@ -1,27 +1,87 @@
 from lux.game_map import Cell, RESOURCE_TYPES, Position
+from lux.game_constants import GAME_CONSTANTS
+from DistanceField import DistanceField
+import Timing
+import numpy as np
+
+DAY_LENGTH = GAME_CONSTANTS["PARAMETERS"]["DAY_LENGTH"]
+NIGHT_LENGTH = GAME_CONSTANTS["PARAMETERS"]["NIGHT_LENGTH"]
+CYCLE_LENGTH = DAY_LENGTH + NIGHT_LENGTH
+MAX_DAYS = GAME_CONSTANTS["PARAMETERS"]["MAX_DAYS"]
+
+class NightForecast:
+    # Forecasts for a list of cities (own and opponent) whether they make it through the nights ahead,
+    # computed for all of them at once with array arithmetic. Cities only burn fuel at night, light_upkeep
+    # per night turn, and go dark on the first night turn their fuel can't cover
+    def __init__(self, cities, turn):
+        self.cityids = [city.cityid for city in cities]
+        self.index = {cityid: i for i, cityid in enumerate(self.cityids)}     # Maps city ids to array index
+        self.teams = np.array([city.team for city in cities], dtype=np.int8)
+        fuel = np.array([city.fuel for city in cities], dtype=np.int64)
+        upkeep = np.maximum(np.array([city.light_upkeep for city in cities], dtype=np.int64), 1)
+
+        cycle_turn = turn % CYCLE_LENGTH
+        if cycle_turn < DAY_LENGTH:
+            night_start = turn + DAY_LENGTH - cycle_turn
+        else:
+            night_start = turn
+        night_end = turn - cycle_turn + CYCLE_LENGTH                          # First turn of the next day
+        self.turns_until_night = night_start - turn
+        self.night_turns = max(min(night_end, MAX_DAYS) - night_start, 0)   # Night turns left in the coming (or current) night
+
+        # Turn of the first night turn each city can't pay for: it covers fuel // upkeep night turns, the
+        # rest of the coming night first and then whole nights one cycle apart
+        covered = fuel // upkeep
+        later = np.maximum(covered - (night_end - night_start), 0)
+        dark_turn = np.where(covered < night_end - night_start, night_start + covered,
+                             night_end + DAY_LENGTH + (later // NIGHT_LENGTH) * CYCLE_LENGTH + later % NIGHT_LENGTH)
+        self.turns_until_dark = np.where(dark_turn < MAX_DAYS, dark_turn - turn, np.iinfo(np.int64).max)
+        self.deficit = np.maximum(upkeep * self.night_turns - fuel, 0)         # Fuel still needed to get through the coming night
+
+    def get_turns_until_dark(self, cityid):
+        return self.turns_until_dark[self.index[cityid]]
+
+    def get_deficit(self, cityid):
+        return self.deficit[self.index[cityid]]
+
+    def needy_cityids(self, team):
+        # Ids of team's cities short of fuel for the coming night, the ones going dark soonest first
+        needy = np.nonzero((self.teams == team) & (self.deficit > 0))[0]
+        order = needy[np.lexsort((-self.deficit[needy], self.turns_until_dark[needy]))]
+        return [self.cityids[i] for i in order.tolist()]
+
 
 class CityWrapper:
     def __init__(self, city_obj, debug):
         self.city = city_obj
         self.debug = debug
+        self.tiles = set()                             # Positions of the city's tiles when the periphery was last updated
+        self.periphery = set()                         # Empty cells next to the city, where it can grow
+        
+    def tiles_changed(self):
+        return len(self.tiles) != len(self.city.citytiles) or any(tile.pos not in self.tiles for tile in self.city.citytiles)
+    
+    def update_periphery(self, game_map):
+        # Recomputes the periphery from scratch, needed when the city itself gained or lost tiles
+        self.tiles = set(tile.pos for tile in self.city.citytiles)
+        self.periphery = set()
+        for pos in self.tiles:
+            for neighbor in game_map.get_neighbours(pos):
+                self.update_periph_cell(neighbor, game_map)
+                
+    def update_periph_cell(self, pos, game_map):
+        # Rechecks one cell next to the city after something was built, destroyed or depleted there
+        cell = game_map.get_cell_by_pos(pos)
+        if cell.citytile is None and not cell.has_resource():
+            self.periphery.add(pos)
+        else:
+            self.periphery.discard(pos)
     
-    def get_nearest_periph_pos(self, loc, game_map):
+    def get_nearest_periph_pos(self, loc, game_map=None):
+        # Return periphery position closest to loc
         if self.debug:
             print("Searching for city build location")
-        # Return periphery tile obj closest to loc (Only works if loc is not inside city)
-        
-        # Sort tiles in city according to distance from loc
-        sorted_tiles = sorted(self.city.citytiles, key=lambda tile: tile.pos.distance_to(loc))
-
-        for tile in sorted_tiles:
-            for direction in [(1, 0), (0, 1), (-1, 0), (0, -1)]:
-                neighbor = Position(tile.pos.x + direction[0], tile.pos.y + direction[1])
-                if neighbor.x >= 0 and neighbor.x < game_map.width and neighbor.y >= 0 and neighbor.y < game_map.height:
-                    cell = game_map.get_cell(neighbor.x, neighbor.y)
-                    if cell.citytile == None and not cell.has_resource():
-                        return neighbor
-                    
-        return None
+        return min(self.periphery, key=loc.distance_to, default=None)
     
     def get_nearest_city_tile(self, loc):
         # Return city tile closest to loc
@@ -49,50 +109,148 @@ class CityWrapper:
         return actions, workers_built
     
 class CitiesWrapper:
-    def __init__(self, cities_list, debug):
-        self.cities = [CityWrapper(city, debug) for city in cities_list]
+    def __init__(self, cities_list, game_map, debug, opponent_cities=(), turn=0):
         self.debug = debug
+        self.city_map = {}                             # Maps city ids to CityWrapper objs, kept across turns
+        self.new_cities = []                           # Ids of cities founded since the last update
+        self.merged_cities = {}                        # Maps ids of cities that joined another city since the last update to its id
+        self.destroyed_cities = []                     # Ids of cities that went dark since the last update
+        self.game_map = None
+        self._all_tiles = set()                        # Positions of all city tiles, own and opponent, last turn
+        self._tile_field = None                        # Distance to nearest city tile, kept until city tiles change
+        self._periph_field = None                      # Distance to nearest periphery cell of any city, same
+        self.update(cities_list, game_map, opponent_cities, turn)
         
-    def update(self, cities_list):
-        self.cities = [CityWrapper(city, self.debug) for city in cities_list]
-    
-    def get_nearest_city(self, loc):
-        # Return CityWrapper obj closest to loc
-        shortest_dist = float("inf")
-        closest = None
+    def update(self, cities_list, game_map, opponent_cities=(), turn=0):
+        opponent_cities = list(opponent_cities)
+        rebuilt = game_map is not self.game_map
+        self._update_cities(cities_list)
+        self.cities = list(self.city_map.values())
+        
+        # Fields over city tiles and peripheries are kept until those change
+        if rebuilt or any(city.tiles_changed() for city in self.cities) or len(self.merged_cities) > 0 or len(self.destroyed_cities) > 0:
+            self._tile_field = None
+            self._periph_field = None
+        if self._update_peripheries(game_map, opponent_cities, rebuilt):
+            self._periph_field = None
         
+        self.game_map = game_map
+        self._needy_field = None                       # Distance to nearest city short of fuel, built once per turn on first use
+        self.forecast = NightForecast([city.city for city in self.cities] + opponent_cities, turn)
+        
+    def _update_cities(self, cities_list):
+        # Updates the wrappers in place from the parsed cities. A city id that disappeared merged into
+        # another city if that city now holds its tiles, otherwise all its tiles went dark
+        self.new_cities = []
+        self.merged_cities = {}
+        self.destroyed_cities = []
+        seen = set()
+        for city in cities_list:
+            wrapper = self.city_map.get(city.cityid)
+            if wrapper is None:
+                wrapper = CityWrapper(city, self.debug)
+                self.city_map[city.cityid] = wrapper
+                self.new_cities.append(city.cityid)
+            wrapper.city = city
+            seen.add(city.cityid)
+        
+        lost = [cityid for cityid in self.city_map if cityid not in seen]
+        if len(lost) == 0:
+            return
+        tile_owners = {tile.pos: city.cityid for city in cities_list for tile in city.citytiles}
+        for cityid in lost:
+            wrapper = self.city_map.pop(cityid)
+            into = next((tile_owners[pos] for pos in wrapper.tiles if pos in tile_owners), None)
+            if into is not None:
+                self.merged_cities[cityid] = into
+            else:
+                self.destroyed_cities.append(cityid)
+            if self.debug:
+                print("City", cityid, "merged into " + into if into is not None else "destroyed")
+        
+    def _update_peripheries(self, game_map, opponent_cities, rebuilt):
+        # Only cells where a city tile was built or lost, or a resource ran out, can enter or leave a
+        # periphery, and only the peripheries of cities next to them. A city that gained or lost tiles
+        # itself, and every city after a full map rebuild, recomputes its periphery instead. Returns
+        # whether any periphery may have changed
+        all_tiles = set(tile.pos for city in self.cities for tile in city.city.citytiles)
+        all_tiles.update(tile.pos for city in opponent_cities for tile in city.citytiles)
+        changed = list(all_tiles.symmetric_difference(self._all_tiles))
+        changed.extend(game_map.depleted)
+        self._all_tiles = all_tiles
+        
+        recomputed = False
+        tile_cities = {}                               # Maps own city tile positions to their CityWrapper
         for city in self.cities:
-            dist = city.get_nearest_city_tile(loc).pos.distance_to(loc)
-            if dist < shortest_dist:
-                shortest_dist = dist
-                closest = city
-                
-        return closest
+            if rebuilt or city.tiles_changed():
+                city.update_periphery(game_map)
+                recomputed = True
+            for pos in city.tiles:
+                tile_cities[pos] = city
+        if rebuilt:
+            return True
+        
+        for pos in changed:
+            for neighbor in game_map.get_neighbours(pos):
+                city = tile_cities.get(neighbor)
+                if city is not None:
+                    city.update_periph_cell(pos, game_map)
+        return recomputed or len(changed) > 0
+
+    def get_tile_field(self):
+        # DistanceField whose targets are (CityWrapper, CityTile) pairs
+        if self._tile_field is None:
+            sources = [(tile.pos, (city, tile)) for city in self.cities for tile in city.city.citytiles]
+            self._tile_field = DistanceField(self.game_map.positions, sources)
+        return self._tile_field
+    
+    def get_needy_field(self):
+        # DistanceField over the tiles of own cities that won't make it through the coming night
+        if self._needy_field is None:
+            sources = []
+            if len(self.cities) > 0:
+                for cityid in self.forecast.needy_cityids(self.cities[0].city.team):
+                    city = self.get_city(cityid)
+                    sources.extend((tile.pos, (city, tile)) for tile in city.city.citytiles)
+            self._needy_field = DistanceField(self.game_map.positions, sources)
+        return self._needy_field
+    
+    def get_city(self, cityid):
+        return self.city_map.get(cityid)
+    
+    def get_nearest_city(self, loc, needy_first=False):
+        # Return CityWrapper obj closest to loc. With needy_first, cities short of fuel come before the rest
+        target = None
+        if needy_first:
+            target = self.get_needy_field().target(loc)
+        if target is None:
+            target = self.get_tile_field().target(loc)
+        if target is None:
+            return None
+        return target[0]
     
     def get_nearest_city_tile(self, loc):
         # Return CityTile obj closest to loc
-        shortest_dist = float("inf")
-        closest = None
-        
-        for city in self.cities:
-            tile = city.get_nearest_city_tile(loc)
-            dist = tile.pos.distance_to(loc)
-            if dist < shortest_dist:
-                shortest_dist = dist
-                closest = tile
-                
-        return closest
+        target = self.get_tile_field().target(loc)
+        if target is None:
+            return None
+        return target[1]
+
+    def get_nearest_city_dist(self, loc):
+        return self.get_tile_field().distance(loc)
     
-    def get_nearest_periph_pos(self, loc, game_map):
-        sorted_cities = sorted(self.cities, key=lambda city: city.get_nearest_city_tile(loc).pos.distance_to(loc))
-        
-        for city in sorted_cities:
-            periph = city.get_nearest_periph_pos(loc, game_map)
-            if periph is not None:
-                return periph
-            
-        return None
+    def get_periph_field(self):
+        # DistanceField over the periphery cells of all cities, targets are the cells themselves
+        if self._periph_field is None:
+            sources = [(pos, pos) for city in self.cities for pos in city.periphery]
+            self._periph_field = DistanceField(self.game_map.positions, sources)
+        return self._periph_field
+    
+    def get_nearest_periph_pos(self, loc, game_map=None):
+        # Return the periphery position of any city closest to loc
+        return self.get_periph_field().target(loc)
     
+    @Timing.timed("cities_get_actions")
     def get_actions(self, controller):
         actions = []
         workers_needed = max(controller.state.num_city_tiles - controller.state.num_workers, 0)
@@ -6,6 +6,9 @@ from lux import annotate
 from Mine import Mines
 from WorkerAgent import Workers
 from CityWrapper import CitiesWrapper
+from Pathfinding import PathPlanner
+from BuildSites import BuildSites
+import Timing
 import numpy as np
 
 class State:
@@ -48,16 +51,21 @@ class Controller:
         self.mines = Mines(game_state, debug)
         self.workers = Workers([unit for unit in player.units if unit.is_worker()], debug)
 #         self.carts = []
-        self.cities = CitiesWrapper(self.player.cities.values(), debug)
+        self.cities = CitiesWrapper(self.player.cities.values(), self.map, debug, self.opponent.cities.values(), game_state.turn)
+        self.paths = PathPlanner(self.map, player.team, debug)
+        self.build_sites = BuildSites(self.map)
         
+    @Timing.timed("controller_update")
     def update(self, game_state, player, opponent):
         self.game_state = game_state
         self.state._update_state(game_state, player, opponent)
         self.map = game_state.map
         self.player = player
         self.opponent = opponent
-        #self.mines.update(game_state)
-        self.cities.update(self.player.cities.values())
+        self.mines.update(game_state)
+        self.cities.update(self.player.cities.values(), self.map, self.opponent.cities.values(), game_state.turn)
+        self.paths.update(self.map, player.team)
+        self.build_sites.update(self.map)
         self.workers.update([unit for unit in player.units if unit.is_worker()])
         
     def get_state_vector(self):
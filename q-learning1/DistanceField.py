@@ -0,0 +1,45 @@
+from collections import deque
+import numpy as np
+
+class DistanceField:
+    # Multi-source BFS over the whole map. After construction, the distance from any cell to the
+    # nearest source and the target attached to that source are dict lookups
+    def __init__(self, positions, sources):
+        self.positions = positions                     # PositionTable of the map
+        self.dist = {}                                 # Maps positions to distance to nearest source
+        self.targets = {}                              # Maps positions to the target of the nearest source
+
+        q = deque()
+        for pos, target in sources:
+            if pos in self.dist:
+                continue
+            self.dist[pos] = 0
+            self.targets[pos] = target
+            q.append(pos)
+
+        neighbours = positions.neighbours
+        while len(q) > 0:
+            p = q.popleft()
+            next_dist = self.dist[p] + 1
+            target = self.targets[p]
+            for neighbor in neighbours[p]:
+                if neighbor not in self.dist:
+                    self.dist[neighbor] = next_dist
+                    self.targets[neighbor] = target
+                    q.append(neighbor)
+
+    def is_empty(self):
+        return len(self.dist) == 0
+
+    def distance(self, loc):
+        return self.dist.get(loc, float("inf"))
+
+    def target(self, loc):
+        return self.targets.get(loc)
+
+    def grid(self):
+        # Distances as a [y, x] array, -1 where no source can be reached
+        grid = np.full((self.positions.height, self.positions.width), -1, dtype=np.int32)
+        for pos, dist in self.dist.items():
+            grid[pos.y, pos.x] = dist
+        return grid
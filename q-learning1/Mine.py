@@ -1,11 +1,124 @@
 from lux.game import Game
 from lux.game_map import Cell, RESOURCE_TYPES, Position
+from DistanceField import DistanceField
+from Assignment import assign_to_targets
+from Pathfinding import WORKER_COOLDOWN
+from YieldMap import YieldMap
+from collections import deque
+import bisect
+import numpy as np
+
+def label_resource_clusters(resource_type):
+    # Labels 4-connected clusters of cells with the same resource type code in a [y, x] grid, using
+    # union-find over a column by column scan so clusters are numbered in the order that scan meets them.
+    # Returns the label grid (-1 where there is no resource) and the number of clusters
+    h, w = resource_type.shape
+    codes = resource_type.T.tolist()                                    # codes[x][y]
+    parent = list(range(w * h))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for x in range(w):
+        for y in range(h):
+            code = codes[x][y]
+            if code == 0:
+                continue
+            i = x * h + y
+            if y > 0 and codes[x][y - 1] == code:
+                parent[find(i)] = find(i - 1)
+            if x > 0 and codes[x - 1][y] == code:
+                root, other = find(i), find(i - h)
+                if root != other:
+                    parent[max(root, other)] = min(root, other)  # Keep the root at the first cell scanned
+    
+    labels = np.full((h, w), -1, dtype=np.int32)
+    root_labels = {}
+    for x in range(w):
+        for y in range(h):
+            if codes[x][y] == 0:
+                continue
+            root = find(x * h + y)
+            if root not in root_labels:
+                root_labels[root] = len(root_labels)
+            labels[y, x] = root_labels[root]
+    return labels, len(root_labels)
+
+class FreeSpots:
+    # Free mining spots bucketed by row, each row sorted by x, so the free spot nearest to a position is
+    # found by bisecting the rows closest to it instead of filtering and sorting every spot
+    def __init__(self, tiles):
+        self.spots = set()
+        self.rows = {}                                                  # Maps y to the free spots in that row
+        self.ys = []                                                    # Sorted ys of the non-empty rows
+        for tile in tiles:
+            self.add(tile)
+            
+    def __len__(self):
+        return len(self.spots)
+    
+    def __contains__(self, pos):
+        return pos in self.spots
+    
+    def add(self, pos):
+        if pos in self.spots:
+            return
+        self.spots.add(pos)
+        row = self.rows.get(pos.y)
+        if row is None:
+            self.rows[pos.y] = [pos]
+            bisect.insort(self.ys, pos.y)
+        else:
+            bisect.insort(row, pos)                                     # Positions in a row order by x
+            
+    def remove(self, pos):
+        if pos not in self.spots:
+            return
+        self.spots.remove(pos)
+        row = self.rows[pos.y]
+        row.pop(bisect.bisect_left(row, pos))
+        if len(row) == 0:
+            self.rows.pop(pos.y)
+            self.ys.pop(bisect.bisect_left(self.ys, pos.y))
+            
+    def nearest(self, loc):
+        # Visits rows from the closest outwards and stops once the row distance alone beats the best spot
+        nearest = None
+        shortest_dist = float("inf")
+        ys = self.ys
+        above = bisect.bisect_left(ys, loc.y) - 1
+        below = above + 1
+        while above >= 0 or below < len(ys):
+            if below < len(ys) and (above < 0 or ys[below] - loc.y <= loc.y - ys[above]):
+                y = ys[below]
+                below += 1
+            else:
+                y = ys[above]
+                above -= 1
+            dy = abs(y - loc.y)
+            if dy >= shortest_dist:
+                break
+            row = self.rows[y]
+            i = bisect.bisect_left(row, (loc.x, y))
+            for spot in row[max(i - 1, 0):i + 1]:
+                dist = dy + abs(spot.x - loc.x)
+                if dist < shortest_dist:
+                    shortest_dist = dist
+                    nearest = spot
+        return nearest
+
 
 class Mine:
     def __init__(self, game_state, resource_tile_set, resource_type, debug):
         self.resource_type = resource_type
         self.resource_tiles = resource_tile_set
+        self.border_tiles = set()                                       # Cells next to the mine a worker can also mine from
         self.assigned_workers = {}                                      # Maps worker IDs to assigned worker_tile
+        self.spot_workers = {}                                          # Maps assigned worker_tiles to worker IDs
+        self.free_spots = FreeSpots(resource_tile_set)
         #self.available_resources = 0
         #self.cart_loc = self.get_cart_loc()
         #self.available_work_tiles = len(self.worker_tiles)              # Number of available worker tiles
@@ -16,64 +129,89 @@ class Mine:
         pass
     
     def _get_open_worker_tile(self, worker_pos):
-        available_tiles = list(filter(lambda tile: tile not in self.assigned_workers.values(), self.resource_tiles))
-        available_tiles = sorted(available_tiles, key=lambda tile: Position(tile[0], tile[1]).distance_to(worker_pos))
-        return available_tiles[0]
+        return self.free_spots.nearest(worker_pos)
     
     def get_resource_tiles(self):
         return self.resource_tiles
     
+    def has_spot(self, pos):
+        return pos in self.resource_tiles or pos in self.border_tiles
+    
+    def iter_spots(self):
+        yield from self.resource_tiles
+        yield from self.border_tiles
+    
+    def iter_yielding_spots(self, yields):                              # Spots a worker can stand on and collect from, city tiles yield nothing
+        return (spot for spot in self.iter_spots() if yields.units_at(spot) > 0)
+    
+    def touches(self, pos, neighbours):                                 # Checks if pos is next to a tile of the mine
+        return any(neighbor in self.resource_tiles for neighbor in neighbours[pos])
+    
     def worker_assigned(self, worker_id):                               # Checks if a given worker is assigned to mine
         return worker_id in self.assigned_workers
     
-    def get_dist(self, loc):                                            # Returns the shortest distance between loc and all spots in mine
-        shortest_dist = float("inf")
-        
-        for tile in self.resource_tiles:
-            tile_pos = Position(tile[0], tile[1])
-            dist = tile_pos.distance_to(loc)
-            if dist < shortest_dist:
-                shortest_dist = dist
-                
-        return shortest_dist
-    
     def has_opening(self):                                              # Checks if there are any available spots in mine
-        return len(self.resource_tiles) > len(self.assigned_workers)
+        return len(self.free_spots) > 0
     
     def assign_worker(self, worker):
-        self.assigned_workers[worker.id] = self._get_open_worker_tile(worker.pos)
+        self.assign_spot(worker, self._get_open_worker_tile(worker.pos))
+
+    def assign_spot(self, worker, spot):
+        self.free_spots.remove(spot)
+        self.assigned_workers[worker.id] = spot
+        self.spot_workers[spot] = worker.id
         
     def release_worker(self, worker):
-        if worker.id in self.assigned_workers:
-            self.assigned_workers.pop(worker.id)
+        self._release_worker_id(worker.id)
+
+    def _release_worker_id(self, worker_id):
+        spot = self.assigned_workers.pop(worker_id, None)
+        if spot is None:
+            return
+        self.spot_workers.pop(spot)
+        if self.has_spot(spot):
+            self.free_spots.add(spot)
         
     def get_assigned_spot(self, worker):
         if worker.id in self.assigned_workers:
             return self.assigned_workers[worker.id]
         return None
     
-    def report_resource_depleted(self, pos, assigned_worker):
-        self.resource_tiles.remove((pos.x, pos.y))
-        self.release_worker(assigned_worker)
+    def is_depleted(self):
+        return len(self.resource_tiles) == 0
+    
+    def remove_tile(self, tile):
+        # Drops a depleted tile along with the worker assigned to it
+        self.resource_tiles.discard(tile)
+        self.border_tiles.discard(tile)
+        self.free_spots.remove(tile)
+        worker_id = self.spot_workers.get(tile)
+        if worker_id is not None:
+            self._release_worker_id(worker_id)
+            
+    def add_border_tile(self, tile):
+        self.border_tiles.add(tile)
+        if tile not in self.spot_workers:
+            self.free_spots.add(tile)
+                
+    def remove_tiles(self, tiles):
+        # Drops tiles that were split off into another mine, workers assigned to them have to find a new spot
+        for tile in tiles:
+            self.remove_tile(tile)
 
     
 class Mines:
     def __init__(self, game_state, debug):
         self.mines = []
         self.debug = debug
+        self.positions = game_state.map.positions
+        self.fields = {}                                                # Maps resource types to DistanceFields over mine tiles
+        self.tile_mines = {}                                            # Maps resource tiles to the mine they belong to
+        self.border_mines = {}                                          # Maps border tiles to the one mine they are a spot of
+        self.yields = YieldMap(game_state.map, game_state.players[game_state.id])
         
         self._build_mines(game_state)
         
-    def _is_valid_tile(self, game_state, x, y, w, h, resource_type, searched):
-        if x < 0 or x >= w or y < 0 or y >= h or (x, y) in searched:
-            return False
-        
-        tile = game_state.map.get_cell(x, y)
-        if not tile.has_resource() or tile.resource.type != resource_type:
-            return False
-        
-        return True
-    
       # This version of the method gathers resource tiles as well as surrounding tiles
 #     def _get_resource_cluster(self, game_state, x, y, w, h, resource_type, cluster_tiles=set(), border_tiles=set(), searched=set()):
 #         # Given x, y of a starting tile, search game map to find tiles of resource cluster
@@ -96,48 +234,31 @@ class Mines:
             
 #         return cluster_tiles, border_tiles, searched    
         
-    def _get_resource_cluster(self, game_state, x, y, w, h, resource_type, cluster_tiles=set(), searched=set()):
-        # Given x, y of a starting tile, search game map to find tiles of resource cluster
-        searched.add((x, y))
-        tile = game_state.map.get_cell(x, y)
-        
-        if not tile.has_resource():                             # Add tile to border set and make no recursive calls
-            return cluster_tiles, searched
-        
-        cluster_tiles.add((x, y))
-        
-        for direction in [(1, 0), (0, 1), (-1, 0), (0, -1)]:  # Call function recursively on surrounding tiles
-            new_x, new_y = x + direction[0], y + direction[1]
-            if self._is_valid_tile(game_state, new_x, new_y, w, h, resource_type, searched):
-                new_cluster_tiles, new_searched = self._get_resource_cluster(game_state, new_x, new_y, w, h, resource_type, cluster_tiles, searched)
-                cluster_tiles = cluster_tiles.union(new_cluster_tiles)
-                searched = searched.union(new_searched)
-            
-        return cluster_tiles, searched
-        
     def _build_mines(self, game_state): 
-        # Iterate over map to find clusters of resource tiles
-        w, h = game_state.map.width, game_state.map.height
-        searched = set()
-        clusters = []
-        resource_types = []
-        
-        for x in range(w):
-            for y in range(h):
-                if (x, y) in searched:
+        # Label clusters of resource tiles on the map and build a mine from each
+        game_map = game_state.map
+        labels, num_clusters = label_resource_clusters(game_map.resource_type)
+        clusters = [set() for _ in range(num_clusters)]
+        resource_types = [None] * num_clusters
+        
+        for y, row in enumerate(labels.tolist()):
+            for x, label in enumerate(row):
+                if label < 0:
                     continue
-                tile = game_state.map.get_cell(x, y)
-                if tile.has_resource():
-                    resource_types.append(tile.resource.type)
-                    cluster, new_searched = self._get_resource_cluster(game_state, x, y, w, h, tile.resource.type, set(), set())
-                    searched = searched.union(new_searched)
-                    clusters.append(cluster)
+                tile = game_map.get_cell(x, y)
+                clusters[label].add(tile.pos)
+                resource_types[label] = tile.resource.type
         
         # ToDo: Merge mines of same resource type that share borders
         
         # Build Mine objs from clusters and borders
         for cluster, resource_type in zip(clusters, resource_types):
-            self.mines.append(Mine(game_state, cluster, resource_type, self.debug))
+            mine = Mine(game_state, cluster, resource_type, self.debug)
+            self.mines.append(mine)
+            for tile in cluster:
+                self.tile_mines[tile] = mine
+        for tile in list(self.tile_mines):
+            self._claim_borders_around(tile)
         
         if self.debug:
             print("Clusters:", clusters)
@@ -150,51 +271,158 @@ class Mines:
 #                     self.actions.append(annotate.x(tile[0], tile[1]))
                     
     def update(self, game_state):
-        # Check mines to see if they need updated
+        # Remove the tiles that ran out of resources since last turn. The incremental game update reports
+        # them directly, otherwise every mine tile has to be checked
+        if game_state.incremental:
+            depleted = game_state.map.depleted
+        else:
+            depleted = [tile for tile in self.tile_mines if not game_state.map.get_cell_by_pos(tile).has_resource()]
+        
+        for tile in depleted:
+            self._remove_tile(game_state, tile)
+        if len(depleted) > 0:
+            self.clear_fields()
+            
+        self.yields = YieldMap(game_state.map, game_state.players[game_state.id])
+        self._release_barren_spots()
+            
+    def _release_barren_spots(self):
+        # Border tiles stop yielding anything once a city is built on them
         for mine in self.mines:
-            needs_update = mine.update_mine(game_state)
+            for worker_id, spot in list(mine.assigned_workers.items()):
+                if self.yields.units_at(spot) == 0:
+                    mine._release_worker_id(worker_id)
+                    
+    def _claim_border(self, tile):
+        # Makes tile a spot of the first mine next to it, unless it is a resource tile or already taken
+        if tile in self.tile_mines or tile in self.border_mines:
+            return
+        for neighbor in self.positions.neighbours[tile]:
+            mine = self.tile_mines.get(neighbor)
+            if mine is not None:
+                mine.add_border_tile(tile)
+                self.border_mines[tile] = mine
+                return
             
-            if needs_update:
-                # Find viable cell from mine to seed cluster search
-                mine_tiles = mine.get_resource_tiles()
-                new_cluster = None
-                new_border = None
-                
-                for tile in mine_tiles:
-                    cell = game_state.map.get_cell(tile[0], tile[1])
-                
-                    if cell.has_resource():
-                        new_cluster, new_border, searched = self._get_resource_cluster(game_state, tile[0], tile[1], gamestate.map.width, gamestate.map.height, cell.resource.type, set(), set())
-                        break
-                
-                self.mines.remove(mine)
-                
-                if new_cluster is not None:
-                    self.mines.append(Mine(game_state, new_cluster, new_border, self.debug))
+    def _claim_borders_around(self, tile):
+        for neighbor in self.positions.neighbours[tile]:
+            self._claim_border(neighbor)
+            
+    def _refresh_borders(self, tiles):
+        # Border tiles no longer next to their mine are dropped, then handed to any other mine they touch
+        for tile in tiles:
+            mine = self.border_mines.get(tile)
+            if mine is not None and not mine.touches(tile, self.positions.neighbours):
+                self.border_mines.pop(tile)
+                mine.remove_tile(tile)
+        for tile in tiles:
+            self._claim_border(tile)
+            
+    def _remove_tile(self, game_state, tile):
+        mine = self.tile_mines.pop(tile, None)
+        if mine is None:
+            return
+        mine.remove_tile(tile)
+        affected = [tile] + self.positions.neighbours[tile]              # Cells that may have stopped or started being border tiles
+        if mine.is_depleted():
+            self.mines.remove(mine)
+            affected.extend(mine.border_tiles)
+        elif self._split_mine(game_state, mine, tile):
+            affected.extend(mine.border_tiles)
+        self._refresh_borders(affected)
+        
+    def _split_mine(self, game_state, mine, tile):
+        # Removing the tile can only disconnect the mine tiles next to it, so search out from those
+        neighbours = [neighbor for neighbor in self.positions.neighbours[tile] if neighbor in mine.resource_tiles]
+        if len(neighbours) < 2:
+            return False
+        
+        components = []
+        unreached = set(neighbours)
+        while len(unreached) > 0:
+            first = len(components) == 0
+            component = self._get_component(unreached.pop(), mine.resource_tiles, unreached, first)
+            if first and len(unreached) == 0:
+                return False                                            # Still in one piece
+            components.append(component)
+        
+        # Keep the largest piece in the original mine, split the rest off
+        components.sort(key=len, reverse=True)
+        for component in components[1:]:
+            new_mine = Mine(game_state, component, mine.resource_type, self.debug)
+            mine.remove_tiles(component)
+            self.mines.append(new_mine)
+            for component_tile in component:
+                self.tile_mines[component_tile] = new_mine
+        if self.debug:
+            print("Mine split into", len(components), "after", tile, "was depleted")
+        return True
+            
+    def _get_component(self, start, tiles, unreached, stop_early):
+        # Tiles connected to start, discarding any of unreached found on the way. With stop_early, gives up
+        # as soon as unreached is empty, which is all that is needed to know the tiles are still connected
+        component = set([start])
+        q = deque([start])
+        neighbours = self.positions.neighbours
+        while len(q) > 0 and not (stop_early and len(unreached) == 0):
+            p = q.popleft()
+            for neighbor in neighbours[p]:
+                if neighbor in tiles and neighbor not in component:
+                    component.add(neighbor)
+                    unreached.discard(neighbor)
+                    q.append(neighbor)
+        return component
+    
+    def clear_fields(self):
+        # Mine tiles may have changed, rebuild the distance fields on next use
+        self.fields = {}
+
+    def get_field(self, resource_type):
+        if resource_type not in self.fields:
+            sources = [(tile, mine) for mine in self.mines if mine.resource_type == resource_type for tile in mine.resource_tiles]
+            self.fields[resource_type] = DistanceField(self.positions, sources)
+        return self.fields[resource_type]
     
     def get_closest_mine(self, loc, resource_type):
-        closest_mine = None
-        shortest_dist = float("inf")
-        
-        for mine in self.mines:
-            if mine.resource_type != resource_type:
-                continue
-            for tile in mine.resource_tiles:
-                tile_pos = Position(tile[0], tile[1])
-                dist = tile_pos.distance_to(loc)
-                
-                if dist < shortest_dist:
-                    shortest_dist = dist
-                    closest_mine = mine
-                    
-        return closest_mine
+        return self.get_field(resource_type).target(loc)
     
     def place_in_mine(self, worker, resource_type):
-        sorted_mines = sorted([mine for mine in self.mines if mine.resource_type == resource_type], key=lambda mine: mine.get_dist(worker.pos))
+        return self.place_workers([worker], resource_type).get(worker.id)
+
+    def get_free_spots(self, resource_type):
+        # Maps every free spot in mines of resource_type to its mine
+        spots = {}
+        for mine in self.mines:
+            if mine.resource_type == resource_type:
+                for spot in mine.free_spots.spots:
+                    spots[spot] = mine
+        return spots
+    
+    def place_workers(self, workers, resource_type):
+        # Places several workers at once so that the total time until their cargo is full, travel plus
+        # collection at the spot's yield, is minimal, instead of each taking a spot in turn. Only each
+        # worker's len(workers) cheapest spots can be part of an optimal matching, so the rest are left
+        # out. Returns {worker id: mine} of placed workers
+        spots = {spot: mine for spot, mine in self.get_free_spots(resource_type).items() if self.yields.units_at(spot) > 0}
+        if len(spots) == 0 or len(workers) == 0:
+            return {}
+        spot_list = list(spots)
+        xs = np.array([spot.x for spot in spot_list])
+        ys = np.array([spot.y for spot in spot_list])
+        units = self.yields.units[ys, xs]
+        worker_xs = np.array([[worker.pos.x] for worker in workers])
+        worker_ys = np.array([[worker.pos.y] for worker in workers])
+        space = np.array([[worker.get_cargo_space_left()] for worker in workers])
+        costs = WORKER_COOLDOWN * (np.abs(xs - worker_xs) + np.abs(ys - worker_ys)) + space / units
         
-        for mine in sorted_mines:
-            if mine.has_opening():
-                mine.assign_worker(worker)
-                return mine 
-            
-        return None
+        num_candidates = min(len(workers), len(spot_list))
+        candidates = np.unique(np.argpartition(costs, num_candidates - 1, axis=1)[:, :num_candidates])
+        cost_rows = costs[:, candidates].tolist()
+        
+        placed = {}
+        matching = assign_to_targets(list(range(len(workers))), list(range(len(candidates))), lambda i, j: cost_rows[i][j])
+        for i, j in matching.items():
+            spot = spot_list[candidates[j]]
+            spots[spot].assign_spot(workers[i], spot)
+            placed[workers[i].id] = spots[spot]
+        return placed
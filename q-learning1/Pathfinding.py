@@ -0,0 +1,237 @@
+import heapq
+from collections import deque
+import numpy as np
+from lux.game_constants import GAME_CONSTANTS
+
+WORKER_COOLDOWN = GAME_CONSTANTS["PARAMETERS"]["UNIT_ACTION_COOLDOWN"]["WORKER"]
+
+class PathPlanner:
+    # A* over the map grid. Opponent city tiles are always blocked, own city tiles only when asked to
+    # avoid them, and stepping onto a tile costs the cooldown a worker would get there (less on roads).
+    # Paths are cached per goal until the obstacles or roads change, so a worker that keeps its
+    # destination just follows the path it already has
+    def __init__(self, game_map, team, debug):
+        self.debug = debug
+        self.version = 0                               # Bumped whenever obstacles or roads change
+        self.paths = {}                                # Maps (goal, avoid_own_cities) to {pos: next pos on path}
+        self._signature = None
+        self.update(game_map, team)
+
+    def update(self, game_map, team):
+        self.game_map = game_map
+        self.positions = game_map.positions
+        self.road = game_map.road.tolist()
+
+        ys, xs = np.nonzero(game_map.citytile_team >= 0)
+        teams = game_map.citytile_team[ys, xs].tolist()
+        grid = self.positions.grid
+        self.own_tiles = set()
+        self.opponent_tiles = set()
+        for x, y, tile_team in zip(xs.tolist(), ys.tolist(), teams):
+            if tile_team == team:
+                self.own_tiles.add(grid[y][x])
+            else:
+                self.opponent_tiles.add(grid[y][x])
+
+        signature = (frozenset(self.own_tiles), frozenset(self.opponent_tiles), game_map.road.tobytes())
+        if signature != self._signature:
+            self._signature = signature
+            self.version += 1
+            self.paths = {}
+        self.flow_fields = {}                          # Target sets move from turn to turn, so flow fields last one turn
+
+    def step_cost(self, pos):
+        return max(WORKER_COOLDOWN - self.road[pos.y][pos.x], 1)
+
+    def is_blocked(self, pos, avoid_own_cities):
+        return pos in self.opponent_tiles or (avoid_own_cities and pos in self.own_tiles)
+
+    def find_path(self, start, goal, avoid_own_cities=False):
+        # Returns the positions after start up to and including goal, or None if goal can't be reached
+        if start == goal:
+            return []
+
+        neighbours = self.positions.neighbours
+        g_score = {start: 0}
+        came_from = {}
+        closed = set()
+        heap = [(start.distance_to(goal), 0, start)]
+        counter = 0                                    # Breaks ties in insertion order instead of comparing positions
+
+        while len(heap) > 0:
+            _, _, p = heapq.heappop(heap)
+            if p == goal:
+                path = []
+                while p != start:
+                    path.append(p)
+                    p = came_from[p]
+                path.reverse()
+                return path
+            if p in closed:
+                continue
+            closed.add(p)
+
+            for neighbor in neighbours[p]:
+                if neighbor in closed or (neighbor != goal and self.is_blocked(neighbor, avoid_own_cities)):
+                    continue
+                g = g_score[p] + self.step_cost(neighbor)
+                if g < g_score.get(neighbor, float("inf")):
+                    g_score[neighbor] = g
+                    came_from[neighbor] = p
+                    counter += 1
+                    heapq.heappush(heap, (g + neighbor.distance_to(goal), counter, neighbor))
+
+        return None
+
+    def get_next_step(self, start, goal, avoid_own_cities=False):
+        # Returns the next position on the path from start to goal, or None if there is no path
+        key = (goal, avoid_own_cities)
+        cached = self.paths.get(key)
+        if cached is not None and start in cached:
+            return cached[start]
+
+        path = self.find_path(start, goal, avoid_own_cities)
+        if path is None or len(path) == 0:
+            return None
+        if cached is None:
+            cached = {}
+            self.paths[key] = cached
+        prev = start
+        for p in path:                                 # Every position on an optimal path leads on along the rest of it
+            cached[prev] = p
+            prev = p
+        return path[0]
+
+    def get_step_direction(self, start, goal, avoid_own_cities=False):
+        step = self.get_next_step(start, goal, avoid_own_cities)
+        if step is None:
+            return None
+        return start.direction_to(step)
+
+    def get_flow_field(self, key, targets, avoid_own_cities=False):
+        # One FlowField per target set and turn, shared by every worker heading there. key identifies
+        # the target set (a mine, a city id) so the targets are only read when the field is built
+        field = self.flow_fields.get((key, avoid_own_cities))
+        if field is None:
+            field = FlowField(self, targets, avoid_own_cities)
+            self.flow_fields[(key, avoid_own_cities)] = field
+        return field
+
+    def get_flow_direction(self, key, targets, start, avoid_own_cities=False):
+        step = self.get_flow_field(key, targets, avoid_own_cities).get_next_step(start)
+        if step is None:
+            return None
+        return start.direction_to(step)
+
+
+class FlowField:
+    # Cheapest cost from every cell to the nearest of a set of targets, found with one Dijkstra search
+    # out from the targets, plus the next step to take from each cell to get there
+    def __init__(self, planner, targets, avoid_own_cities):
+        self.cost = {}                                 # Maps positions to cost of reaching the nearest target
+        self.next = {}                                 # Maps positions to the next step towards it
+
+        neighbours = planner.positions.neighbours
+        target_set = set(targets)
+        heap = []
+        counter = 0
+        for target in target_set:
+            self.cost[target] = 0
+            heap.append((0, counter, target))
+            counter += 1
+        heapq.heapify(heap)
+
+        while len(heap) > 0:
+            cost, _, p = heapq.heappop(heap)
+            if cost > self.cost[p]:
+                continue
+            if p not in target_set and planner.is_blocked(p, avoid_own_cities):
+                continue                               # Can step out of a blocked cell but not through one
+            step_cost = planner.step_cost(p)
+            for neighbor in neighbours[p]:
+                new_cost = cost + step_cost
+                if new_cost < self.cost.get(neighbor, float("inf")):
+                    self.cost[neighbor] = new_cost
+                    self.next[neighbor] = p
+                    counter += 1
+                    heapq.heappush(heap, (new_cost, counter, neighbor))
+
+    def get_next_step(self, pos):
+        return self.next.get(pos)
+
+
+class ReservationTable:
+    # Space-time reservations of cells, keyed by (position, turn). Cells in shared (own city tiles)
+    # can hold any number of units and are never reserved
+    def __init__(self, shared=()):
+        self.shared = shared
+        self.cells = {}                                # Maps (pos, turn) to id of the unit that will be there
+        self.edges = set()                             # (start, end, turn) of every reserved move
+
+    def is_free(self, pos, turn):
+        return pos in self.shared or (pos, turn) not in self.cells
+
+    def reserve(self, pos, turn, unit_id):
+        if pos not in self.shared:
+            self.cells[(pos, turn)] = unit_id
+
+    def reserve_move(self, start, end, turn, unit_id):
+        self.reserve(end, turn, unit_id)
+        self.edges.add((start, end, turn))
+
+    def is_swap(self, start, end, turn):
+        return (end, start, turn) in self.edges
+
+    def resolve(self, moves, turn):
+        # Resolves all intended moves into turn in one pass. moves is a list of (unit_id, start, candidates)
+        # where candidates are the steps the unit would take, best first. Units that are not moving must
+        # already be reserved. A unit only steps into a cell another mover is leaving once that mover is
+        # known to get away, and falls back to staying put. Returns a dict of unit id to end position
+        result = {}
+        occupants = {start: unit_id for unit_id, start, _ in moves if start not in self.shared}
+        by_id = {unit_id: (start, candidates) for unit_id, start, candidates in moves}
+        waiting = {}                                   # Maps unit ids to the movers waiting for them to leave
+        queue = deque(unit_id for unit_id, _, _ in moves)
+        unresolved = iter(by_id)
+
+        while len(queue) > 0 or len(result) < len(moves):
+            if len(queue) == 0:
+                # Everyone left is waiting in a cycle, the first of them stays put to break it
+                unit_id = next(unit_id for unit_id in unresolved if unit_id not in result)
+                start = by_id[unit_id][0]
+                self.reserve(start, turn, unit_id)
+                result[unit_id] = start
+                queue.extend(waiting.pop(unit_id, []))
+                continue
+
+            unit_id = queue.popleft()
+            if unit_id in result:
+                continue
+            start, candidates = by_id[unit_id]
+
+            end = start
+            blocker = None
+            for step in candidates:
+                if not self.is_free(step, turn) or self.is_swap(start, step, turn):
+                    continue
+                occupant = occupants.get(step)
+                if occupant is not None and occupant != unit_id and occupant not in result:
+                    blocker = occupant
+                    break
+                if occupant is not None and occupant != unit_id and result[occupant] == step:
+                    continue
+                end = step
+                break
+
+            if blocker is not None:
+                waiting.setdefault(blocker, []).append(unit_id)
+                continue
+
+            if end == start:
+                self.reserve(start, turn, unit_id)
+            else:
+                self.reserve_move(start, end, turn, unit_id)
+            result[unit_id] = end
+            queue.extend(waiting.pop(unit_id, []))
+
+        return result
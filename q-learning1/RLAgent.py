@@ -12,6 +12,8 @@ from tensorflow.keras import Model, Sequential
 from tensorflow.keras.layers import Dense, Input, Reshape
 from tensorflow.keras.optimizers import Adam
 from pathlib import Path
+from ReplayBuffer import ReplayBuffer, PrioritizedReplayBuffer
+import Timing
 
 class RLAgent:
     def __init__(self, agent_name, settings=None, model=None, do_explore=True, record_replays=True):
@@ -30,8 +32,11 @@ class RLAgent:
             model.save(agent_name + "_model")
                 
         self.action_space = self._get_action_space()
-        self.experience_replay = []
         self.state_size = 9
+        self.prioritized_replay = settings.get("prioritized_replay", False)
+        self.replay_buffer = None                      # Only agents that record or train on replays load them
+        if record_replays:
+            self.replay_buffer = self._make_replay_buffer(settings)
         self.action_size = len(self.action_space)
         self.train_batch_size = settings["train_batch_size"]
         self.train_interval = settings["train_interval"]
@@ -39,11 +44,34 @@ class RLAgent:
         self.epsilon = settings["epsilon"]
         self.reward_weights = settings["reward_weights"]
         self.num_explore_turns = settings["num_explore_turns"]
+        self.target_sync_interval = settings.get("target_sync_interval", 100)    # Train steps between hard target syncs
+        self.target_tau = settings.get("target_tau", 0.0)                        # Soft (Polyak) update rate per train step, 0 for hard syncs
+        self.double_dqn = settings.get("double_dqn", False)
         self.explore_timer = 0
         self.exploring = False
         self.explore_action = None
+        self.train_steps = 0
         self.q_net = keras.models.load_model(self.agent_name + "_model")
-        self.target_net = self.q_net
+        
+        # The target network and the train step count it syncs on carry over between training runs, a new
+        # model starts them from the Q-network and 0 and saves them over the previous model's
+        if model is None and Path(self.agent_name + "_target_model").exists():
+            self.target_net = keras.models.load_model(self.agent_name + "_target_model")
+            if Path(self.agent_name + "_train_steps").exists():
+                with open(self.agent_name + "_train_steps", "rb") as steps_file:
+                    self.train_steps = pickle.load(steps_file)
+        else:
+            self.target_net = keras.models.clone_model(self.q_net)
+            self.target_net.set_weights(self.q_net.get_weights())
+            if model is not None:
+                self.save_target()
+        
+    def _make_replay_buffer(self, settings):
+        path = self.agent_name + "_replay_buffer"
+        capacity = settings.get("replay_capacity", 100000)
+        if self.prioritized_replay:
+            return PrioritizedReplayBuffer(path, self.state_size, capacity, settings.get("priority_alpha", 0.6), settings.get("priority_beta", 0.4))
+        return ReplayBuffer(path, self.state_size, capacity)
         
     def _get_action_space(self):
         action_space = []
@@ -55,6 +83,7 @@ class RLAgent:
                     
         return action_space
     
+    @Timing.timed("rl_get_action")
     def get_action(self, state):
         if self.exploring:
             self.explore_timer -= 1
@@ -76,33 +105,69 @@ class RLAgent:
     def lookup_action(self, code):
         return self.action_space[code]
     
+    def get_targets(self, states, actions, rewards, next_states, last_turns):
+        # Bellman targets for a whole minibatch from one forward pass over the states and one over the
+        # next states. Only the taken actions' Q-values change, so the loss ignores the other outputs.
+        # With Double DQN the Q-network picks the next action and the target network values it. Also
+        # returns the TD-errors of the taken actions
+        batch = np.arange(len(actions))
+        next_q = np.array(self.target_net.predict_on_batch(next_states))
+        if self.double_dqn:
+            q_vals = np.array(self.q_net.predict_on_batch(np.concatenate([states, next_states])))
+            targets, next_online = q_vals[:len(actions)], q_vals[len(actions):]
+            next_values = next_q[batch, np.argmax(next_online, axis=1)]
+        else:
+            targets = np.array(self.q_net.predict_on_batch(states))
+            next_values = np.amax(next_q, axis=1)
+        returns = rewards + self.gamma * next_values * (1 - last_turns)
+        td_errors = returns - targets[batch, actions]
+        targets[batch, actions] = returns
+        return targets, td_errors
+    
+    def update_target(self):
+        # Soft update every train step if target_tau is set, otherwise copy the weights every target_sync_interval steps
+        if self.target_tau > 0:
+            tau = self.target_tau
+            self.target_net.set_weights([tau * w + (1 - tau) * t for w, t in zip(self.q_net.get_weights(), self.target_net.get_weights())])
+        elif self.train_steps % self.target_sync_interval == 0:
+            self.target_net.set_weights(self.q_net.get_weights())
+    
+    @Timing.timed("rl_train_step")
+    def train_step(self, states, actions, rewards, next_states, last_turns, weights=None):
+        # weights are per-transition loss weights, the importance-sampling weights with prioritized replay.
+        # Returns the loss and the TD-errors before the update
+        targets, td_errors = self.get_targets(states, actions, rewards, next_states, last_turns)
+        loss = self.q_net.train_on_batch(states, targets, sample_weight=weights)
+        self.train_steps += 1
+        self.update_target()
+        return loss, td_errors
+    
+    @Timing.timed("rl_train")
     def train(self, batch_size):
-        replays = []
-        with open(self.agent_name + "_replays", "rb") as replay_file:
-            replays = pickle.load(replay_file)
-
-        for replay in replays:
-            replay[0] = np.array(replay[0]).reshape(1, -1)
-            replay[3] = np.array(replay[3]).reshape(1, -1)
-        replay_sample = random.sample(replays, batch_size)
-        
-        for state, action, reward, next_state, last_turn in replay_sample:
-            target = self.q_net.predict(state)
-            
-            if last_turn:
-                target[0][action] = reward
-            else:
-                t = self.target_net.predict(next_state)
-                target[0][action] = reward + self.gamma * np.amax(t[0])
-            
-            self.q_net.fit(state, target, epochs=1, verbose=0)
+        if self.prioritized_replay:
+            indices, weights = self.replay_buffer.sample_prioritized(batch_size)
+        else:
+            indices, weights = self.replay_buffer.sample_indices(batch_size), None
+        states, actions, rewards, next_states, last_turns = self.replay_buffer.get(indices)
+        _, td_errors = self.train_step(states, actions, rewards, next_states, last_turns.astype(np.float32), weights)
+        if self.prioritized_replay:
+            self.replay_buffer.update_priorities(indices, td_errors)
         self.q_net.save(self.agent_name + "_model")
+        self.save_target()
+        
+    def save_target(self):
+        self.target_net.save(self.agent_name + "_target_model")
+        with open(self.agent_name + "_train_steps", "wb") as steps_file:
+            pickle.dump(self.train_steps, steps_file)
     
     def add_replay(self, replay):
-        replays = []
-        with open(self.agent_name + "_replays", "rb") as replay_file:
-            replays = pickle.load(replay_file)
-        with open(self.agent_name + "_replays", "wb") as replay_file:
-            replays.append(replay)
-            pickle.dump(replays, replay_file)
+        # replay is [state, action, reward, next_state, last_turn]. Replays are written to disk at the end
+        # of the match, or by flush_replays
+        state, action, reward, next_state, last_turn = replay
+        self.replay_buffer.add(state, action, reward, next_state, last_turn)
+        if last_turn:
+            self.flush_replays()
+            
+    def flush_replays(self):
+        self.replay_buffer.flush()
 
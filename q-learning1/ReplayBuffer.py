@@ -0,0 +1,236 @@
+import json
+import os
+import shutil
+import numpy as np
+
+class ReplayBuffer:
+    # Transitions (state, action, reward, next_state, done) in preallocated arrays, used as a ring buffer
+    # once capacity is reached so the oldest transitions are overwritten first. The arrays are mirrored in
+    # .npy files under path; flush() only writes the transitions added since the last flush, through
+    # memory maps, so saving an episode costs the size of the episode rather than of the whole buffer
+    FIELDS = ["states", "actions", "rewards", "next_states", "dones"]
+
+    def __init__(self, path, state_size, capacity=100000):
+        self.path = path
+        self.state_size = state_size
+        self.capacity = capacity
+        self.size = 0                                  # Number of transitions held
+        self.next_index = 0                            # Where the next transition goes
+        self.unflushed = 0                             # Transitions added since the last flush
+        self._allocate()
+        self._load()
+
+    def _allocate(self):
+        self.states = np.zeros((self.capacity, self.state_size), dtype=np.float32)
+        self.actions = np.zeros(self.capacity, dtype=np.int32)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.next_states = np.zeros((self.capacity, self.state_size), dtype=np.float32)
+        self.dones = np.zeros(self.capacity, dtype=np.bool_)
+
+    def _file(self, name):
+        return os.path.join(self.path, name + ".npy")
+
+    def _load(self):
+        # Picks up the transitions saved by earlier runs. A buffer saved with a different capacity keeps
+        # its most recent transitions that fit
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        saved = {name: np.load(self._file(name), mmap_mode="r") for name in self.FIELDS}
+        if meta["capacity"] == self.capacity:
+            for name in self.FIELDS:
+                getattr(self, name)[:] = saved[name]
+            self.size = meta["size"]
+            self.next_index = meta["next_index"]
+            return
+        
+        order = (np.arange(meta["size"]) + meta["next_index"] - meta["size"]) % meta["capacity"]  # Oldest first
+        order = order[-self.capacity:]
+        for name in self.FIELDS:
+            getattr(self, name)[:len(order)] = saved[name][order]
+        self.size = len(order)
+        self.next_index = self.size % self.capacity
+        self._rewrite()
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done):
+        i = self.next_index
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.next_index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.unflushed = min(self.unflushed + 1, self.capacity)
+        return i
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        # Adds arrays of transitions in order, as repeated add() would. Returns the indices written to
+        num_new = len(actions)
+        indices = (self.next_index + np.arange(num_new)) % self.capacity
+        keep = slice(max(num_new - self.capacity, 0), num_new)      # Only the last capacity transitions survive
+        for name, values in zip(self.FIELDS, (states, actions, rewards, next_states, dones)):
+            getattr(self, name)[indices[keep]] = np.asarray(values)[keep]
+        self.next_index = (self.next_index + num_new) % self.capacity
+        self.size = min(self.size + num_new, self.capacity)
+        self.unflushed = min(self.unflushed + num_new, self.capacity)
+        return indices[keep]
+
+    def sample_indices(self, batch_size):
+        return np.random.choice(self.size, min(batch_size, self.size), replace=False)
+
+    def get(self, indices):
+        return (self.states[indices], self.actions[indices], self.rewards[indices],
+                self.next_states[indices], self.dones[indices])
+
+    def sample(self, batch_size):
+        # Uniform minibatch without replacement, as arrays
+        return self.get(self.sample_indices(batch_size))
+
+    def _open_files(self):
+        # Memory maps of the .npy files, created at full capacity the first time
+        os.makedirs(self.path, exist_ok=True)
+        files = {}
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            if os.path.exists(self._file(name)):
+                files[name] = np.load(self._file(name), mmap_mode="r+")
+            else:
+                files[name] = np.lib.format.open_memmap(self._file(name), mode="w+", dtype=array.dtype, shape=array.shape)
+        return files
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, "meta.json"), "w") as meta_file:
+            json.dump({"size": self.size, "next_index": self.next_index, "capacity": self.capacity}, meta_file)
+
+    def flush(self):
+        # Writes the transitions added since the last flush, in at most two chunks when they wrap around
+        if self.unflushed == 0:
+            return
+        files = self._open_files()
+        start = (self.next_index - self.unflushed) % self.capacity
+        chunks = [(start, min(start + self.unflushed, self.capacity))]
+        if start + self.unflushed > self.capacity:
+            chunks.append((0, self.next_index))
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            for chunk_start, chunk_end in chunks:
+                files[name][chunk_start:chunk_end] = array[chunk_start:chunk_end]
+            files[name].flush()
+        self._write_meta()
+        self.unflushed = 0
+
+    def _rewrite(self):
+        # Saves the whole buffer from scratch, after loading it resized
+        self.clear_files()
+        self.unflushed = self.size
+        self.flush()
+
+    def clear_files(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+    def reset(self):
+        # Drops every transition, in memory and on disk
+        self.clear_files()
+        self.size = 0
+        self.next_index = 0
+        self.unflushed = 0
+        self._allocate()
+
+
+class SumTree:
+    # Binary tree over capacity leaves where every node holds the sum of its children, so a leaf can be
+    # drawn in proportion to its value, and a value changed, in O(log n). Both work on whole arrays of
+    # leaves at once, one tree level at a time
+    def __init__(self, capacity):
+        self.num_leaves = 1
+        while self.num_leaves < capacity:
+            self.num_leaves *= 2
+        self.nodes = np.zeros(2 * self.num_leaves, dtype=np.float64)     # Root at 1, leaves from num_leaves on
+
+    def total(self):
+        return self.nodes[1]
+
+    def get(self, indices):
+        return self.nodes[np.asarray(indices) + self.num_leaves]
+
+    def set(self, indices, values):
+        nodes = np.asarray(indices, dtype=np.int64) + self.num_leaves
+        if len(nodes) == 0:
+            return
+        self.nodes[nodes] = values
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        # Leaf index of each value's position along the cumulative sum of the leaves
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.num_leaves:
+            left = 2 * nodes
+            go_right = values >= self.nodes[left]
+            values -= self.nodes[left] * go_right
+            nodes = left + go_right
+        return nodes - self.num_leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    # ReplayBuffer sampled in proportion to priority^alpha, where a transition's priority is its last
+    # TD-error. New transitions get the highest priority seen so they are replayed at least once, and so do
+    # transitions loaded from disk since priorities aren't saved. Samples come with importance-sampling
+    # weights (N * P)^-beta, scaled so the largest is 1, that undo the bias of not sampling uniformly
+    def __init__(self, path, state_size, capacity=100000, alpha=0.6, beta=0.4, epsilon=1e-3):
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon                         # Keeps transitions with no TD-error sampleable
+        self.max_priority = 1.0
+        super().__init__(path, state_size, capacity)
+
+    def _allocate(self):
+        super()._allocate()
+        self.tree = SumTree(self.capacity)
+
+    def _load(self):
+        super()._load()
+        if self.size > 0:
+            self.tree.set(np.arange(self.size), self.max_priority ** self.alpha)
+
+    def add(self, state, action, reward, next_state, done):
+        i = super().add(state, action, reward, next_state, done)
+        self.tree.set([i], self.max_priority ** self.alpha)
+        return i
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        indices = super().add_batch(states, actions, rewards, next_states, dones)
+        self.tree.set(indices, self.max_priority ** self.alpha)
+        return indices
+
+    def sample_indices(self, batch_size):
+        return self.sample_prioritized(batch_size)[0]
+
+    def sample_prioritized(self, batch_size):
+        # One draw from each of batch_size equal slices of the total priority. Returns (indices, weights)
+        if self.size == 0:
+            raise ValueError("Can't sample from an empty replay buffer")
+        batch_size = min(batch_size, self.size)
+        segment = self.tree.total() / batch_size
+        values = (np.arange(batch_size) + np.random.rand(batch_size)) * segment
+        indices = np.minimum(self.tree.find(values), self.size - 1)
+        probs = self.tree.get(indices) / self.tree.total()
+        weights = (self.size * probs) ** -self.beta
+        return indices, (weights / weights.max()).astype(np.float32)
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.set(indices, priorities ** self.alpha)
@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import random
+import time
+import numpy as np
+
+# Plays training matches in a pool of processes. Each match gets its own Agent and opponent instance and its
+# own seed, and sends its transitions back to the parent, which adds them all to the one replay buffer.
+# Processes are spawned rather than forked since TensorFlow doesn't survive a fork
+
+_rl_agent = None                                       # The pool process's RLAgent, loaded once and shared by its matches
+
+
+def _init_process(agent_name):
+    global _rl_agent
+    from RLAgent import RLAgent
+    _rl_agent = RLAgent(agent_name, do_explore=True, record_replays=False)
+
+
+def _play_match(job):
+    from kaggle_environments import make
+    from agent import Agent
+    from base_agent import BaseAgent
+
+    seed, opponent = job
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    _rl_agent.exploring = False
+    learner = Agent(_rl_agent.agent_name, do_explore=True, collect_transitions=True, rl_agent=_rl_agent)
+    if opponent == "base_agent":
+        base_agent = BaseAgent()
+        opponent = lambda observation, configuration: base_agent(observation, configuration)
+
+    env = make("lux_ai_2021", configuration={"seed": seed, "loglevel": 1, "annotations": True}, debug=True)
+    env.run([lambda observation, configuration: learner(observation, configuration), opponent])
+    return seed, learner.take_transitions()
+
+
+def run_rollouts(agent_name, num_matches, num_processes=None, opponent="base_agent", base_seed=562124210):
+    # Plays num_matches matches of the agent against opponent ("base_agent", or any agent kaggle_environments
+    # knows by name) and adds their transitions to the agent's replay buffer. Returns (matches per hour,
+    # transitions per second)
+    from RLAgent import RLAgent
+    rl_agent = RLAgent(agent_name, do_explore=False, record_replays=True)
+    num_processes = num_processes or os.cpu_count()
+    jobs = [(base_seed + i, opponent) for i in range(num_matches)]
+
+    num_transitions = 0
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(max(min(num_processes, num_matches), 1), initializer=_init_process, initargs=(agent_name,)) as pool:
+        for i, (seed, transitions) in enumerate(pool.imap_unordered(_play_match, jobs)):
+            rl_agent.replay_buffer.add_batch(*transitions)
+            num_transitions += len(transitions[1])
+            print("Match", i + 1, "of", num_matches, "completed (seed {}, {} transitions)".format(seed, len(transitions[1])))
+    rl_agent.flush_replays()
+
+    elapsed = time.perf_counter() - start
+    matches_per_hour = num_matches * 3600 / elapsed
+    transitions_per_second = num_transitions / elapsed
+    print("{} matches in {:.1f} s over {} processes: {:.1f} matches/hour, {:.1f} transitions/s".format(
+        num_matches, elapsed, min(num_processes, num_matches), matches_per_hour, transitions_per_second))
+    return matches_per_hour, transitions_per_second
@@ -0,0 +1,121 @@
+import csv
+import functools
+import json
+import os
+import time
+import numpy as np
+
+# Wall time of each phase of a turn (parsing, controller update, worker and city actions, the RL agent's
+# decision and training), kept per agent so the two agents of a local match don't mix. Off unless the
+# LUX_TIMING environment variable is set or enable() is called; while off, timed functions cost one
+# flag check and phase() hands back a shared do-nothing context manager
+
+enabled = os.environ.get("LUX_TIMING", "0") not in ("", "0")
+samples = {}                                           # Maps agent names to {phase name: [seconds, ...]}
+current_agent = "agent"                                # Agent whose turn is being timed
+matches_dumped = 0
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def set_agent(name):
+    global current_agent
+    current_agent = name
+
+
+def record(name, elapsed):
+    samples.setdefault(current_agent, {}).setdefault(name, []).append(elapsed)
+
+
+class _Phase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    # with Timing.phase("game_update"): ...
+    if not enabled:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+def timed(name):
+    # Decorator recording the wall time of every call under name
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def summary(agent=None):
+    # Per phase call count and p50/p95/max/total wall time in milliseconds
+    result = {}
+    for name, times in samples.get(agent or current_agent, {}).items():
+        ms = np.array(times) * 1e3
+        result[name] = {
+            "count": len(times),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "max_ms": float(ms.max()),
+            "total_ms": float(ms.sum())
+        }
+    return result
+
+
+def dump(path, agent=None):
+    # Writes the summary as JSON, or as CSV if path ends in .csv
+    stats = summary(agent)
+    with open(path, "w", newline="") as out_file:
+        if path.endswith(".csv"):
+            writer = csv.writer(out_file)
+            writer.writerow(["phase", "count", "p50_ms", "p95_ms", "max_ms", "total_ms"])
+            for name, row in stats.items():
+                writer.writerow([name, row["count"], row["p50_ms"], row["p95_ms"], row["max_ms"], row["total_ms"]])
+        else:
+            json.dump(stats, out_file, indent=2)
+
+
+def end_match(agent=None, extension=".json"):
+    # Dumps the agent's timings to timing_<agent>_<pid>_<n><extension> next to the agent and starts over.
+    # Does nothing if nothing was recorded, so it is safe to call at the start of every match as well
+    global matches_dumped
+    agent = agent or current_agent
+    if not enabled or len(samples.get(agent, {})) == 0:
+        return None
+    matches_dumped += 1
+    path = os.path.join(AGENT_DIR, "timing_{}_{}_{}{}".format(agent, os.getpid(), matches_dumped, extension))
+    dump(path, agent)
+    samples.pop(agent)
+    return path
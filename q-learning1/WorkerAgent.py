@@ -3,6 +3,9 @@ from lux.game import Game
 from lux.game_map import Cell, RESOURCE_TYPES, Position
 from lux.constants import Constants
 from lux.game_constants import GAME_CONSTANTS
+from Pathfinding import ReservationTable
+from Assignment import assign_to_targets
+import Timing
 import sys
 import math
 
@@ -19,6 +22,8 @@ class WorkerAgent:
         self.objective_changed = False
         self.mine = None
         self.destination = None
+        self.destination_city = None                    # cityid when heading for any tile of a city
+        self.avoid_city = False
         
     def update(self, worker_obj):
         self.worker = worker_obj
@@ -45,11 +50,11 @@ class WorkerAgent:
         return self.worker.pos == mining_spot
     
     def _update_mining(self, controller):
-        if self._at_mining_spot():
-            cell = controller.map.get_cell_by_pos(self.worker.pos)
-            if not cell.has_resource():
-                self.mine.report_resource_depleted(self.worker.pos, self.worker)
-                self.mine = None
+        if self.mine is not None and not self.mine.worker_assigned(self.worker.id):
+            # Mining spot ran out or was split off into another mine
+            if self.destination_city is None and self.worker.get_cargo_space_left() > 0:
+                self.destination = None
+            self.mine = None
          
         if self.objective == WorkerObjective.GatherFuel:
             best_fuel = self._get_best_fuel(controller.player)
@@ -63,25 +68,35 @@ class WorkerAgent:
                 self.mine.release_worker(self.worker)
                 self.mine = None
             self.destination = None
+            self.destination_city = None
             self.objective_changed = False
             if self.debug:
                 print("Worker", self.worker.id, "assigned new objective")
                 
-    def _handle_mine_assignment(self, controller):
-        if self.destination is None and self.mine is None and self.objective != WorkerObjective.Rest:
-            resource_type = RESOURCE_TYPES.WOOD
-            if self.objective == WorkerObjective.GatherFuel:
-                resource_type = self._get_best_fuel(controller.player)
-            self._find_open_mine(resource_type, controller.mines)
-            if self.debug:
-                if self.mine is not None:
-                    print("Worker", self.worker.id, "assigned to mining spot", self.get_mining_spot())
-                else:
-                    print("Unable to place worker", self.worker.id, "in mine")
+    def _in_destination_city(self, game_map):
+        if self.destination_city is None:
+            return False
+        tile = game_map.get_cell_by_pos(self.worker.pos).citytile
+        return tile is not None and tile.cityid == self.destination_city
+    
+    def _set_destination_city(self, controller, needy_first=False):
+        city = controller.cities.get_nearest_city(self.worker.pos, needy_first)
+        if city is not None:
+            self.destination = city.get_nearest_city_tile(self.worker.pos).pos
+            self.destination_city = city.city.cityid
+                
+    def _follow_city_changes(self, cities):
+        # The city being headed for may have merged into another or gone dark since last turn
+        if self.destination_city in cities.merged_cities:
+            self.destination_city = cities.merged_cities[self.destination_city]
+        elif self.destination_city in cities.destroyed_cities:
+            self.destination = None
+            self.destination_city = None
                 
-    def _handle_destination_arrival(self):
-        if self.destination is not None and self.worker.pos == self.destination:
+    def _handle_destination_arrival(self, game_map):
+        if self.destination is not None and (self.worker.pos == self.destination or self._in_destination_city(game_map)):
             self.destination = None  
+            self.destination_city = None
             if self.debug:
                 print("Worker", self.worker.id, "arrived at their destination")
         
@@ -90,11 +105,9 @@ class WorkerAgent:
             return
         
         if self.objective == WorkerObjective.Rest and not self.on_city_tile(controller.map):
-            closest_city_tile = controller.cities.get_nearest_city_tile(self.worker.pos)
-            if closest_city_tile is not None:
-                self.destination = closest_city_tile.pos
+            self._set_destination_city(controller)
             if self.debug:
-                print("Worker", self.worker.id, "destination set to city tile", (self.destination.x, self.destination.y))
+                print("Worker", self.worker.id, "destination set to city tile", self.destination)
             return
             
         if self.worker.get_cargo_space_left() == 0: 
@@ -105,15 +118,13 @@ class WorkerAgent:
             if self.debug:
                 print("Worker", self.worker.id, "is at max cargo")
             if self.objective == WorkerObjective.GatherFuel:
-                nearest_city_tile = controller.cities.get_nearest_city_tile(self.worker.pos)
-                if nearest_city_tile is not None:
-                    self.destination = nearest_city_tile.pos
+                self._set_destination_city(controller, needy_first=True)
             elif self.objective == WorkerObjective.BuildCity:
                 # nearest_periph = controller.cities.get_nearest_periph_pos(self.worker.pos, controller.map)
                 # if nearest_periph is not None:
                 #     self.destination = nearest_periph
                 # else:
-                self.destination = self.find_nearest_empty_tile(self.worker.pos, controller.map)
+                self.destination = controller.build_sites.nearest(self.worker.pos)
             if self.debug:
                 print("Worker", self.worker.id, "destination changed to", self.destination)
             return
@@ -129,10 +140,10 @@ class WorkerAgent:
         if self.mine == None:
             return None
         
-        tile = self.mine.get_assigned_spot(self.worker)
-        if tile is not None:
-            return Position(tile[0], tile[1])
-        return None
+        return self.mine.get_assigned_spot(self.worker)
+        
+    def is_busy(self):
+        return self.mine is not None or self.destination is not None
         
     def set_objective(self, objective):
         if self.objective == objective:
@@ -142,120 +153,161 @@ class WorkerAgent:
         if self.debug:
             print("Worker", self.worker.id, "has new objective", self.objective)
         
-    def get_step_direction(self, game_map, avoid_city=False):
-        direction = self.worker.pos.direction_to(self.destination)
+    def _get_flow_target(self, controller):
+        # Target sets many workers share get a flow field: a city being delivered to, and a mine until
+        # the worker reaches it. Other destinations are single cells and use the cached A* paths. Border
+        # spots taken by a city tile are left out of a mine's targets, as opponent ones can't be entered
+        if self.destination_city is not None:
+            city = controller.cities.get_city(self.destination_city)
+            if city is not None:
+                return self.destination_city, [tile.pos for tile in city.city.citytiles]
+        if self.mine is not None and self.destination == self.get_mining_spot() and not self.mine.has_spot(self.worker.pos):
+            return self.mine, self.mine.iter_yielding_spots(controller.mines.yields)
+        return None
         
-        if avoid_city:                     # Get best detour
-            alt_dirs = ["n", "s"] if direction in ["e", "w"] else ["e", "w"]
-            step = step = self.worker.pos.translate(direction, 1)
-            
-            cell = game_map.get_cell(step.x, step.y)
-            if cell.citytile is None:
-                return direction
-            
-            shortest_dist = float("inf")
-            best_dir = None
-            for alt_dir in alt_dirs:
-                step = self.worker.pos.translate(alt_dir, 1)
-                if step.x < 0 or step.x >= game_map.width or step.y < 0 or step.y >= game_map.height:
-                    continue
-                cell = game_map.get_cell(step.x, step.y)
-                dist = step.distance_to(self.destination) 
-                if cell.citytile is None and dist < shortest_dist:
-                    best_dir = alt_dir
-                    
-            if best_dir is not None:
-                return best_dir
-            
-            backward_dir = set(["n", "s", "e", "w"]).difference(set([direction] + alt_dirs)).pop()
-            return backward_dir
-              
+    def get_step_direction(self, controller, avoid_city=False):
+        flow_target = self._get_flow_target(controller)
+        if flow_target is not None:
+            key, targets = flow_target
+            direction = controller.paths.get_flow_direction(key, targets, self.worker.pos, avoid_city)
+        else:
+            direction = controller.paths.get_step_direction(self.worker.pos, self.destination, avoid_city)
+        if direction is None:                   # No way around the obstacles, head straight for the destination
+            direction = self.worker.pos.direction_to(self.destination)
         return direction
-            
+
+    def get_step_candidates(self, controller, step):
+        # The planned step first, even when it detours around obstacles, then any other step that still
+        # gets closer to the destination
+        candidates = []
+        dist = self.worker.pos.distance_to(self.destination)
+        for neighbor in [step] + controller.map.get_neighbours(self.worker.pos):
+            if neighbor in candidates or (neighbor != step and neighbor.distance_to(self.destination) >= dist):
+                continue
+            if neighbor != self.destination and controller.paths.is_blocked(neighbor, self.avoid_city):
+                continue
+            candidates.append(neighbor)
+        return candidates
     
     def on_city_tile(self, game_map):
         tile = game_map.get_cell_by_pos(self.worker.pos)
         return tile.citytile is None
     
-    def find_nearest_empty_tile(self, loc, game_map):
-        if self.tile_is_empty(loc, game_map):
-            return loc
-        
-        searched = set()
-        q = [loc]
-        
-        while len(q) > 0:
-            p = q.pop(0)
-            searched.add((p.x, p.y))
-            
-            if self.tile_is_empty(p, game_map):
-                return p
-            
-            for direction in [(1, 0), (0, 1), (-1, 0), (0, -1)]:
-                neighbor = Position(p.x + direction[0], p.y + direction[1])
-                if neighbor.x >= 0 and neighbor.x < game_map.width and neighbor.y >= 0 and neighbor.y < game_map.height and (neighbor.x, neighbor.y) not in searched:
-                    q.append(neighbor)
-            
-            
-    def tile_is_empty(self, pos, game_map):
-        cell = game_map.get_cell(pos.x, pos.y)
-        return cell.citytile is None and not cell.has_resource()
-    
-    def get_action(self, controller, steps):
+    def prepare(self, controller):
+        # Bookkeeping that has to happen before workers are placed in mines and build sites as a batch
+        self._follow_city_changes(controller.cities)
         self._update_mining(controller)
         
         if not self.worker.can_act():
-            return None, (self.worker.pos.x, self.worker.pos.y)
+            return
         
         self._handle_objective_change()
-        self._handle_mine_assignment(controller)
-        self._handle_destination_arrival()
+        self._handle_destination_arrival(controller.map)
+        
+    def needs_mine(self):
+        return (self.destination is None and self.mine is None and self.objective != WorkerObjective.Rest
+                and self.worker.get_cargo_space_left() > 0 and self.worker.can_act())
+    
+    def needs_build_site(self):
+        return (self.destination is None and self.objective == WorkerObjective.BuildCity
+                and self.worker.get_cargo_space_left() == 0 and self.worker.can_act())
+    
+    def get_mine_resource_type(self, player):
+        if self.objective == WorkerObjective.GatherFuel:
+            return self._get_best_fuel(player)
+        return RESOURCE_TYPES.WOOD
+    
+    def set_build_site(self, site):
+        if self.mine is not None:
+            self.mine.release_worker(self.worker)
+            self.mine = None
+        if site == self.worker.pos:                   # Already there, builds this turn
+            return
+        self.destination = site
+        if self.debug:
+            print("Worker", self.worker.id, "destination changed to build site", site)
+    
+    def get_action(self, controller):
+        if not self.worker.can_act():
+            return None, self.worker.pos
         
         if self.destination is None and self.objective == WorkerObjective.BuildCity and self.worker.can_build(controller.map):
             if self.debug:
                 print("Worker", self.worker.id, "building city tile at", self.worker.pos)
-            return self.worker.build_city(), (self.worker.pos.x, self.worker.pos.y)
+            return self.worker.build_city(), self.worker.pos
         
         self._handle_destination_assignment(controller)
                 
         if self.destination is not None:
-            avoid_city = self.objective == WorkerObjective.BuildCity and self.worker.get_cargo_space_left() == 0
-            step_dir = self.get_step_direction(controller.map, avoid_city)
+            self.avoid_city = self.objective == WorkerObjective.BuildCity and self.worker.get_cargo_space_left() == 0
+            step_dir = self.get_step_direction(controller, self.avoid_city)
             if self.debug:
                 print("Worker", self.worker.id, "step direction:", step_dir)
             # step_dir = self.worker.pos.direction_to(self.destination)
             step = self.worker.pos.translate(step_dir, 1)
-            return self.worker.move(step_dir), (step.x, step.y)
+            return self.worker.move(step_dir), step
         
-        return None, (self.worker.pos.x, self.worker.pos.y)
+        return None, self.worker.pos
     
 class Workers:
     def __init__(self, worker_list, debug):
         self.debug = debug
         self.workers = {}                              # Maps worker ids to WorkerAgent objs
         self.task_proportions = [0.5, 0.5, 0.0]
+        self.objective_workers = {objective: set() for objective in WorkerObjective}     # Maps objectives to ids of workers pursuing them
         
         for worker in worker_list:
-            self.workers[worker.id] = WorkerAgent(worker, self.debug)
+            self._add_worker(worker)
             
         if self.debug:
             print("Workers object initialized")
-
-        self._reassign_objectives()
             
-    def _reassign_objectives(self):
-        num_city_builders = math.ceil(self.task_proportions[0] * len(self.workers))
-        num_fuel_gatherers = math.ceil(self.task_proportions[1] * len(self.workers))
-        worker_ids = self.workers.keys()
+    def _get_objective_targets(self, num_workers):
+        # How many workers each objective should have: task proportions rounded up, city building first
+        num_city_builders = min(math.ceil(self.task_proportions[0] * num_workers), num_workers)
+        num_fuel_gatherers = min(math.ceil(self.task_proportions[1] * num_workers), num_workers - num_city_builders)
+        return {
+            WorkerObjective.BuildCity: num_city_builders,
+            WorkerObjective.GatherFuel: num_fuel_gatherers,
+            WorkerObjective.Rest: num_workers - num_city_builders - num_fuel_gatherers
+        }
+    
+    def _set_objective(self, worker_id, objective):
+        worker = self.workers[worker_id]
+        self.objective_workers[worker.objective].discard(worker_id)
+        self.objective_workers[objective].add(worker_id)
+        worker.set_objective(objective)
+            
+    def _add_worker(self, worker_obj):
+        # New workers take the objective furthest below its target, existing workers keep theirs
+        worker = WorkerAgent(worker_obj, self.debug)
+        self.workers[worker_obj.id] = worker
+        targets = self._get_objective_targets(len(self.workers))
+        objective = max(WorkerObjective, key=lambda objective: targets[objective] - len(self.objective_workers[objective]))
+        self.objective_workers[worker.objective].add(worker_obj.id)
+        self._set_objective(worker_obj.id, objective)
         
-        for i, worker_id in enumerate(worker_ids):
-            if i < num_city_builders:
-                self.workers[worker_id].set_objective(WorkerObjective.BuildCity)
-                continue
-            if i < num_city_builders + num_fuel_gatherers:
-                self.workers[worker_id].set_objective(WorkerObjective.GatherFuel)
-                continue
-            self.workers[worker_id].set_objective(WorkerObjective.Rest)
+    def _remove_worker(self, worker_id):
+        worker = self.workers.pop(worker_id)
+        self.objective_workers[worker.objective].discard(worker_id)
+        if worker.mine is not None:
+            worker.mine.release_worker(worker.worker)
+            
+    def _rebalance_objectives(self):
+        # Moves the fewest workers needed to bring every objective to its target, preferring workers that
+        # have no mine or destination to give up
+        targets = self._get_objective_targets(len(self.workers))
+        surplus = []
+        for objective in WorkerObjective:
+            extra = len(self.objective_workers[objective]) - targets[objective]
+            if extra > 0:
+                idle_first = sorted(self.objective_workers[objective], key=lambda worker_id: (self.workers[worker_id].is_busy(), worker_id))
+                surplus.extend(idle_first[:extra])
+                
+        for objective in WorkerObjective:
+            missing = targets[objective] - len(self.objective_workers[objective])
+            for _ in range(missing):
+                self._set_objective(surplus.pop(), objective)
 
     # Converts directions to degrees
     def _to_degrees(self, direction):
@@ -279,31 +331,86 @@ class Workers:
         # Remove workers that were lost last turn
         lost_workers = set(self.workers.keys()).difference(set([worker.id for worker in worker_list]))
         for lost_worker in lost_workers:
-            self.workers.pop(lost_worker)
+            self._remove_worker(lost_worker)
             
         for worker in worker_list:
             if worker.id in self.workers:
                 self.workers[worker.id].update(worker)
                 continue
                 
-            self.workers[worker.id] = WorkerAgent(worker, self.debug)
-            self._reassign_objectives()
+            self._add_worker(worker)
             if self.debug:
                 print("Worker added")
                 
     def update_task_proportions(self, proportions):
         self.task_proportions = proportions
-        self._reassign_objectives()
+        self._rebalance_objectives()
+            
             
+    def _assign_mines(self, controller):
+        # Workers looking for a mining spot are matched to spots together, one matching per resource type
+        by_type = {}
+        for worker in self.workers.values():
+            if worker.needs_mine():
+                by_type.setdefault(worker.get_mine_resource_type(controller.player), []).append(worker)
+                
+        for resource_type, workers in by_type.items():
+            placed = controller.mines.place_workers([worker.worker for worker in workers], resource_type)
+            for worker in workers:
+                worker.mine = placed.get(worker.worker.id)
+                if self.debug:
+                    if worker.mine is not None:
+                        print("Worker", worker.worker.id, "assigned to mining spot", worker.get_mining_spot())
+                    else:
+                        print("Unable to place worker", worker.worker.id, "in mine")
+                        
+    def _assign_build_sites(self, controller):
+        # Full city builders are matched to distinct empty tiles so they don't all head for the same one.
+        # Only each builder's len(builders) nearest empty tiles can be part of an optimal matching
+        builders = [worker for worker in self.workers.values() if worker.needs_build_site()]
+        if len(builders) == 0:
+            return
+        
+        sites = set()
+        for worker in builders:
+            sites.update(controller.build_sites.nearest_k(worker.worker.pos, len(builders)))
+        matching = assign_to_targets(builders, sorted(sites), lambda worker, site: worker.worker.pos.distance_to(site))
+        for worker, site in matching.items():
+            worker.set_build_site(site)
             
+    @Timing.timed("workers_get_actions")
     def get_actions(self, controller):
         actions = []
-        steps = set()
+        moves = []
+        turn = controller.game_state.turn + 1
+        
+        # Units that won't move this turn hold their cells, own city tiles can take any number of units
+        reservations = ReservationTable(controller.paths.own_tiles)
+        for unit in controller.opponent.units:
+            reservations.reserve(unit.pos, turn, unit.id)
+        for unit in controller.player.units:
+            if unit.id not in self.workers:
+                reservations.reserve(unit.pos, turn, unit.id)
+        
+        for worker in self.workers.values():
+            worker.prepare(controller)
+        self._assign_mines(controller)
+        self._assign_build_sites(controller)
         
         for worker in self.workers.values():
-            action, step = worker.get_action(controller, steps)
-            steps.add(step)
-            if action is not None:
-                actions.append(action)
+            action, step = worker.get_action(controller)
+            if step == worker.worker.pos:
+                reservations.reserve(step, turn, worker.worker.id)
+                if action is not None:
+                    actions.append(action)
+                continue
+            moves.append((worker.worker.id, worker.worker.pos, worker.get_step_candidates(controller, step)))
+            
+        for worker_id, end in reservations.resolve(moves, turn).items():
+            worker = self.workers[worker_id].worker
+            if end != worker.pos:
+                actions.append(worker.move(worker.pos.direction_to(end)))
+            elif self.debug:
+                print("Worker", worker_id, "move blocked, staying at", worker.pos)
                 
         return actions
@@ -0,0 +1,39 @@
+import numpy as np
+from lux.game_map import RESOURCE_CODES
+from lux.game_constants import GAME_CONSTANTS
+
+COLLECTION_RATES = GAME_CONSTANTS["PARAMETERS"]["WORKER_COLLECTION_RATE"]
+FUEL_RATES = GAME_CONSTANTS["PARAMETERS"]["RESOURCE_TO_FUEL_RATE"]
+
+class YieldMap:
+    # What a worker standing on each cell would collect in one turn. Workers collect from their own cell
+    # and the four adjacent ones, so the per-tile collection is summed over a plus-shaped neighbourhood
+    # with shifted array adds. Workers don't collect on city tiles, so those yield nothing
+    def __init__(self, game_map, player):
+        researched = ["wood"]
+        if player.researched_coal():
+            researched.append("coal")
+        if player.researched_uranium():
+            researched.append("uranium")
+
+        tile_units = np.zeros(game_map.resource_type.shape, dtype=np.int32)
+        tile_fuel = np.zeros(game_map.resource_type.shape, dtype=np.int32)
+        for r_type in researched:
+            name = r_type.upper()
+            units = np.where(game_map.resource_type == RESOURCE_CODES[r_type],
+                             np.minimum(game_map.resource_amount, COLLECTION_RATES[name]), 0)
+            tile_units += units
+            tile_fuel += units * FUEL_RATES[name]
+
+        can_collect = game_map.citytile_team < 0
+        self.units = self._neighbourhood_sum(tile_units) * can_collect     # Resource units collected per turn, [y, x]
+        self.fuel = self._neighbourhood_sum(tile_fuel) * can_collect       # Fuel value of those units, [y, x]
+        self._units = self.units.tolist()
+
+    def _neighbourhood_sum(self, grid):
+        padded = np.pad(grid, 1)
+        return (padded[1:-1, 1:-1] + padded[:-2, 1:-1] + padded[2:, 1:-1]
+                + padded[1:-1, :-2] + padded[1:-1, 2:])
+
+    def units_at(self, pos):
+        return self._units[pos.y][pos.x]
@@ -5,54 +5,91 @@ from lux.game_constants import GAME_CONSTANTS
 from lux import annotate
 from Controller import Controller
 from RLAgent import *
+import Timing
 
 def calculate_reward(s, s_prime, reward_weights):
         reward_vec = (s_prime[0] - s[0]) * np.array(reward_weights)
         return np.sum(reward_vec)
 
-# we declare this global game_state object so that state persists across turns so we do not need to reinitialize it all the time
-game_state = None
-controller = None
-state = None
-action_code = None
-rl_agent = None
-def agent(observation, configuration):
-    global game_state
-    global controller
-    global state
-    global action_code
-    global rl_agent
-
-    ### Do not edit ###
-    if observation["step"] == 0:
-        game_state = Game()
-        game_state._initialize(observation["updates"])
-        game_state._update(observation["updates"][2:])
-        game_state.id = observation.player
+class Agent:
+    # One agent's state across the turns of a match, so several can play at once, each in its own
+    # rollout process. With collect_transitions the transitions are kept in self.transitions for the
+    # caller instead of going to the RL agent's replay buffer. Without an rl_agent, a new RLAgent is loaded
+    # at the start of every match so it picks up the latest trained model
+    def __init__(self, agent_name="test", do_explore=False, record_replays=False, collect_transitions=False, rl_agent=None):
+        self.agent_name = agent_name
+        self.do_explore = do_explore
+        self.record_replays = record_replays
+        self.collect_transitions = collect_transitions
+        self.reload_rl_agent = rl_agent is None
+        self.rl_agent = rl_agent
+        self.game_state = None
+        self.controller = None
+        self.state = None
+        self.action_code = None
+        self.transitions = []                          # [state, action, reward, next_state, last_turn] lists
+        
+    def take_transitions(self):
+        # Returns the collected transitions as (states, actions, rewards, next_states, last_turns) arrays
+        # and starts collecting afresh
+        transitions = self.transitions
+        self.transitions = []
+        if len(transitions) == 0:
+            no_states = np.zeros((0, self.rl_agent.state_size), dtype=np.float32)
+            return no_states, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32), no_states, np.zeros(0, dtype=np.bool_)
+        states, actions, rewards, next_states, last_turns = zip(*transitions)
+        return (np.array(states, dtype=np.float32), np.array(actions, dtype=np.int32), np.array(rewards, dtype=np.float32),
+                np.array(next_states, dtype=np.float32), np.array(last_turns, dtype=np.bool_))
         
-        player = game_state.players[observation.player]
-        opponent = game_state.players[(observation.player + 1) % 2]
-        controller = Controller(game_state, player, opponent, False)
-        state = controller.get_state_vector()
+    def __call__(self, observation, configuration):
+        Timing.set_agent("agent")
+        ### Do not edit ###
+        if observation["step"] == 0:
+            Timing.end_match()                      # Previous match may have ended before the last turn
+            if self.rl_agent is not None and self.rl_agent.record_replays:
+                self.rl_agent.flush_replays()
+            self.game_state = Game()
+            self.game_state._initialize(observation["updates"])
+            with Timing.phase("game_update"):
+                self.game_state._update(observation["updates"][2:])
+            self.game_state.id = observation.player
+            
+            player = self.game_state.players[observation.player]
+            opponent = self.game_state.players[(observation.player + 1) % 2]
+            self.controller = Controller(self.game_state, player, opponent, False)
+            self.state = self.controller.get_state_vector()
+            
+            if self.reload_rl_agent:
+                self.rl_agent = RLAgent(self.agent_name, do_explore=self.do_explore, record_replays=self.record_replays)
+            self.action_code = 54
+            reward = 0
+        else:
+            with Timing.phase("game_update"):
+                self.game_state._update(observation["updates"])
+            player = self.game_state.players[observation.player]
+            opponent = self.game_state.players[(observation.player + 1) % 2]
+            self.controller.update(self.game_state, player, opponent)
         
-        rl_agent = RLAgent("test", do_explore=False, record_replays=False)
-        action_code = 54
-        reward = 0
-    else:
-        game_state._update(observation["updates"])
-        player = game_state.players[observation.player]
-        opponent = game_state.players[(observation.player + 1) % 2]
-        controller.update(game_state, player, opponent)
-    
-        s_prime = controller.get_state_vector()
-        reward = calculate_reward(state, s_prime, rl_agent.reward_weights)
-        if rl_agent.record_replays:
-            rl_agent.add_replay([list(state[0]), action_code, reward, list(s_prime[0]), game_state.turn == 359])
-        state = s_prime
-    
-        action_code = rl_agent.get_action(state)
-    action = rl_agent.lookup_action(action_code)
-    print(action, state, reward)
-    controller.apply_agent_action(action)  
+            s_prime = self.controller.get_state_vector()
+            reward = calculate_reward(self.state, s_prime, self.rl_agent.reward_weights)
+            replay = [list(self.state[0]), self.action_code, reward, list(s_prime[0]), self.game_state.turn == 359]
+            if self.collect_transitions:
+                self.transitions.append(replay)
+            elif self.rl_agent.record_replays:
+                self.rl_agent.add_replay(replay)
+            self.state = s_prime
+        
+            self.action_code = self.rl_agent.get_action(self.state)
+        action = self.rl_agent.lookup_action(self.action_code)
+        print(action, self.state, reward)
+        self.controller.apply_agent_action(action)  
+
+        actions = self.controller.get_actions()
+        if self.game_state.turn == GAME_CONSTANTS["PARAMETERS"]["MAX_DAYS"] - 1:
+            Timing.end_match()
+        return actions
 
-    return controller.get_actions()
+# The agent kaggle_environments and main.py play with. kaggle_environments wants a plain function
+default_agent = Agent("test", do_explore=False, record_replays=False)
+def agent(observation, configuration):
+    return default_agent(observation, configuration)
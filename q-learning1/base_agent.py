@@ -4,32 +4,44 @@ from lux.constants import Constants
 from lux.game_constants import GAME_CONSTANTS
 from lux import annotate
 from Controller import Controller
+import Timing
 import math
 import sys
 
-# we declare this global game_state object so that state persists across turns so we do not need to reinitialize it all the time
-game_state = None
-controller = None
-
-def base_agent(observation, configuration):
-    global game_state
-    global controller
-
-    ### Do not edit ###
-    if observation["step"] == 0:
-        game_state = Game()
-        game_state._initialize(observation["updates"])
-        game_state._update(observation["updates"][2:])
-        game_state.id = observation.player
+class BaseAgent:
+    # The scripted agent without the RL layer, one instance per match being played at the same time
+    def __init__(self):
+        self.game_state = None
+        self.controller = None
         
-        player = game_state.players[observation.player]
-        opponent = game_state.players[(observation.player + 1) % 2]
-        controller = Controller(game_state, player, opponent, False)
+    def __call__(self, observation, configuration):
+        Timing.set_agent("base_agent")
+        ### Do not edit ###
+        if observation["step"] == 0:
+            Timing.end_match()                      # Previous match may have ended before the last turn
+            self.game_state = Game()
+            self.game_state._initialize(observation["updates"])
+            with Timing.phase("game_update"):
+                self.game_state._update(observation["updates"][2:])
+            self.game_state.id = observation.player
+            
+            player = self.game_state.players[observation.player]
+            opponent = self.game_state.players[(observation.player + 1) % 2]
+            self.controller = Controller(self.game_state, player, opponent, False)
+            
+        else:
+            with Timing.phase("game_update"):
+                self.game_state._update(observation["updates"])
+            player = self.game_state.players[observation.player]
+            opponent = self.game_state.players[(observation.player + 1) % 2]
+            self.controller.update(self.game_state, player, opponent)
         
-    else:
-        game_state._update(observation["updates"])
-        player = game_state.players[observation.player]
-        opponent = game_state.players[(observation.player + 1) % 2]
-        controller.update(game_state, player, opponent)
-    
-    return controller.get_actions()
+        actions = self.controller.get_actions()
+        if self.game_state.turn == GAME_CONSTANTS["PARAMETERS"]["MAX_DAYS"] - 1:
+            Timing.end_match()
+        return actions
+
+# The agent kaggle_environments plays with. kaggle_environments wants a plain function
+default_agent = BaseAgent()
+def base_agent(observation, configuration):
+    return default_agent(observation, configuration)
@@ -0,0 +1,248 @@
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from lux.game import Game
+from lux.game_map import Position
+
+# Generates observations that look like the ones the Lux engine sends (same line formats and
+# roughly the same number of resource, unit, city and road lines), so the per-turn cost of the
+# agent can be measured without running kaggle_environments
+
+def make_match(width, height, num_turns, seed=0):
+    rng = random.Random(seed)
+    resources = {}
+    for _ in range(width * height // 60 + 2):       # Resources come in clusters grown from random seeds
+        x, y = rng.randrange(width), rng.randrange(height)
+        r_type = rng.choices(["wood", "coal", "uranium"], [6, 2, 1])[0]
+        for _ in range(rng.randint(4, 30)):
+            resources[(x, y)] = (r_type, rng.randint(100, 500))
+            dx, dy = rng.choice([(1, 0), (0, 1), (-1, 0), (0, -1)])
+            x, y = min(max(x + dx, 0), width - 1), min(max(y + dy, 0), height - 1)
+
+    free = [(x, y) for x in range(width) for y in range(height) if (x, y) not in resources]
+    rng.shuffle(free)
+    city_tiles = {0: [free.pop()], 1: [free.pop()]}
+    units = {0: {}, 1: {}}
+    next_unit = 0
+    turns = []
+
+    for turn in range(num_turns):
+        # Grow cities, spawn and move units and deplete some resources
+        for team in (0, 1):
+            if turn % 10 == 0 and len(free) > 0:
+                city_tiles[team].append(free.pop())
+            if len(units[team]) < len(city_tiles[team]):
+                x, y = city_tiles[team][-1]
+                units[team]["u_" + str(next_unit)] = [x, y, 0]
+                next_unit += 1
+            for unit in units[team].values():
+                unit[0] = min(max(unit[0] + rng.choice([-1, 0, 1]), 0), width - 1)
+                unit[1] = min(max(unit[1] + rng.choice([-1, 0, 1]), 0), height - 1)
+                unit[2] = min(unit[2] + rng.randint(0, 20), 100)
+        for tile in rng.sample(list(resources), min(3, len(resources))):
+            r_type, amount = resources[tile]
+            amount -= rng.randint(20, 100)
+            if amount <= 0:
+                resources.pop(tile)
+            else:
+                resources[tile] = (r_type, amount)
+
+        updates = []
+        for team in (0, 1):
+            updates.append("rp {} {}".format(team, turn // 4))
+        for (x, y), (r_type, amount) in resources.items():
+            updates.append("r {} {} {} {}".format(r_type, x, y, amount))
+        for team in (0, 1):
+            for unitid, (x, y, wood) in units[team].items():
+                updates.append("u 0 {} {} {} {} {} {} 0 0".format(team, unitid, x, y, turn % 2, wood))
+        for team in (0, 1):
+            cityid = "c_" + str(team + 1)
+            updates.append("c {} {} {} {}".format(team, cityid, 100 + turn, 23 * len(city_tiles[team])))
+            for x, y in city_tiles[team]:
+                updates.append("ct {} {} {} {} {}".format(team, cityid, x, y, turn % 10))
+        for team in (0, 1):
+            for x, y in city_tiles[team]:
+                updates.append("ccd {} {} 6".format(x, y))
+        updates.append("D_DONE")
+        turns.append(updates)
+
+    return turns
+
+
+def load_replay(path):
+    # Reads the observations player 0 received from a kaggle_environments replay file
+    with open(path) as replay_file:
+        replay = json.load(replay_file)
+    turns = [step[0]["observation"]["updates"] for step in replay["steps"]]
+    width, height = [int(n) for n in turns[0][1].split(" ")]
+    turns[0] = turns[0][2:]
+    return width, height, turns
+
+
+def new_game(width, height, incremental=True):
+    game_state = Game()
+    game_state._initialize(["0", "{} {}".format(width, height)], incremental)
+    return game_state
+
+
+def time_updates(turns, width, height, incremental=True):
+    game_state = new_game(width, height, incremental)
+    start = time.perf_counter()
+    for updates in turns:
+        game_state._update(updates)
+    return (time.perf_counter() - start) / len(turns)
+
+
+def bench_update(sizes, num_turns):
+    print("Game._update per-turn cost")
+    for size in sizes:
+        turns = make_match(size, size, num_turns)
+        rebuild = time_updates(turns, size, size, incremental=False)
+        incremental = time_updates(turns, size, size, incremental=True)
+        print("{}x{}: rebuild {:.1f} us, incremental {:.1f} us ({:.2f}x)".format(
+            size, size, rebuild * 1e6, incremental * 1e6, rebuild / incremental))
+
+
+def bench_parse(matches):
+    print("Game._update throughput")
+    for name, width, height, turns in matches:
+        game_state = new_game(width, height)
+        num_lines = 0
+        start = time.perf_counter()
+        for updates in turns:
+            counts = game_state._update(updates)
+            num_lines += sum(counts.values())
+        elapsed = time.perf_counter() - start
+        print("{}: {} lines in {:.3f} s, {:.0f} lines/s, {:.0f} lines/turn".format(
+            name, num_lines, elapsed, num_lines / elapsed, num_lines / len(turns)))
+
+
+def bench_objects(size, num_turns):
+    print("Game state memory and Position workload, {}x{}".format(size, size))
+    turns = make_match(size, size, num_turns)
+
+    tracemalloc.start()
+    game_state = new_game(size, size)
+    for updates in turns:
+        game_state._update(updates)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("Parsed state: {:.1f} KiB (peak {:.1f} KiB)".format(current / 1024, peak / 1024))
+
+    # Roughly what the agents do with positions in one turn: step every unit towards every
+    # resource tile and look the tiles up in a set
+    tiles = set(cell.pos for row in game_state.map.map for cell in row if cell.has_resource())
+    units = [unit for player in game_state.players for unit in player.units]
+    start = time.perf_counter()
+    for unit in units:
+        for tile in tiles:
+            step = unit.pos.translate(unit.pos.direction_to(tile), 1)
+            step in tiles
+    elapsed = time.perf_counter() - start
+    print("{} unit/tile pairs: {:.2f} ms per turn".format(len(units) * len(tiles), elapsed * 1e3))
+
+
+def bench_mines(sizes, repeats):
+    from Mine import Mines
+    print("Mines.__init__ on the first turn")
+    for size in sizes:
+        game_state = new_game(size, size)
+        game_state._update(make_match(size, size, 1)[0])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            mines = Mines(game_state, False)
+        elapsed = (time.perf_counter() - start) / repeats
+        print("{}x{}: {} mines, {:.2f} ms".format(size, size, len(mines.mines), elapsed * 1e3))
+
+
+def make_test_agent(directory, capacity=10000):
+    # RLAgent with a fresh model like reset_model.py builds, saved under directory, and a replay buffer
+    # filled with random transitions
+    import numpy as np
+    from tensorflow.keras import Sequential
+    from tensorflow.keras.layers import Dense
+    from tensorflow.keras.optimizers import Adam
+    from RLAgent import RLAgent
+
+    settings = {
+        "gamma": 0.2,
+        "epsilon": 0.1,
+        "num_explore_turns": 5,
+        "train_batch_size": 60,
+        "train_interval": 60,
+        "reward_weights": (1, 1, 1, -1, -1, -1, 0.2, -0.2, -0.5),
+        "replay_capacity": capacity
+    }
+    model = Sequential()
+    model.add(Dense(50, activation='relu', input_dim=9))
+    model.add(Dense(50, activation='relu'))
+    model.add(Dense(55, activation='linear'))
+    model.compile(loss='mse', optimizer=Adam(learning_rate=0.2))
+    rl_agent = RLAgent(os.path.join(directory, "bench"), settings, model)
+
+    rng = np.random.default_rng(0)
+    for i in range(capacity):
+        rl_agent.replay_buffer.add(rng.random(9), rng.integers(55), rng.random(), rng.random(9), i % 360 == 359)
+    return rl_agent
+
+
+def bench_train(batch_sizes, num_steps):
+    # Transitions per second through a DQN update, batched against one transition at a time the way
+    # RLAgent.train used to do it
+    import tempfile
+    import numpy as np
+    print("DQN training throughput")
+    with tempfile.TemporaryDirectory() as directory:
+        rl_agent = make_test_agent(directory)
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            for _ in range(num_steps):
+                states, actions, rewards, next_states, last_turns = rl_agent.replay_buffer.sample(batch_size)
+                rl_agent.train_step(states, actions, rewards, next_states, last_turns.astype(np.float32))
+            batched = num_steps * batch_size / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            states, actions, rewards, next_states, last_turns = rl_agent.replay_buffer.sample(batch_size)
+            for i in range(batch_size):
+                target = rl_agent.q_net.predict(states[i:i + 1])
+                t = rl_agent.target_net.predict(next_states[i:i + 1])
+                target[0][actions[i]] = rewards[i] + rl_agent.gamma * np.amax(t[0]) * (1 - last_turns[i])
+                rl_agent.q_net.fit(states[i:i + 1], target, epochs=1, verbose=0)
+            per_transition = batch_size / (time.perf_counter() - start)
+            print("batch {}: {:.0f} transitions/s batched, {:.0f} transitions/s one at a time ({:.1f}x)".format(
+                batch_size, batched, per_transition, batched / per_transition))
+
+
+def generated_matches(sizes, num_turns):
+    return [("{}x{}".format(size, size), size, size, make_match(size, size, num_turns)) for size in sizes]
+
+
+def recorded_matches(paths):
+    return [(path,) + load_replay(path) for path in paths]
+
+
+if __name__ == "__main__":
+    # python benchmark.py update [num_turns]
+    # python benchmark.py parse [replay.json ...]
+    # python benchmark.py objects [map_size]
+    # python benchmark.py mines [repeats]
+    # python benchmark.py train [num_steps]
+    bench = sys.argv[1] if len(sys.argv) > 1 else "update"
+    args = sys.argv[2:]
+    sizes = [12, 16, 24, 32]
+
+    if bench == "update":
+        bench_update(sizes, int(args[0]) if len(args) > 0 else 360)
+    elif bench == "parse":
+        bench_parse(recorded_matches(args) if len(args) > 0 else generated_matches(sizes, 360))
+    elif bench == "objects":
+        bench_objects(int(args[0]) if len(args) > 0 else 32, 120)
+    elif bench == "mines":
+        bench_mines(sizes, int(args[0]) if len(args) > 0 else 20)
+    elif bench == "train":
+        bench_train([32, 60, 256], int(args[0]) if len(args) > 0 else 50)
+    else:
+        print("Unknown benchmark", bench)
@@ -6,81 +6,107 @@ INPUT_CONSTANTS = Constants.INPUT_CONSTANTS
 
 
 class Game:
-    def _initialize(self, messages):
+    def _initialize(self, messages, incremental=True):
         """
         initialize state
+
+        with incremental set, the map, players and cities are kept alive across turns and
+        updated in place instead of being rebuilt from scratch on every _update
         """
         self.id = int(messages[0])
         self.turn = -1
+        self.incremental = incremental
         # get some other necessary initial input
         mapInfo = messages[1].split(" ")
         self.map_width = int(mapInfo[0])
         self.map_height = int(mapInfo[1])
         self.map = GameMap(self.map_width, self.map_height)
         self.players = [Player(0), Player(1)]
+        # Resource lines are collected and ingested in one batch, everything else is parsed line by line
+        self._parsers = {
+            INPUT_CONSTANTS.RESEARCH_POINTS: self._parse_research_points,
+            INPUT_CONSTANTS.UNITS: self._parse_unit,
+            INPUT_CONSTANTS.CITY: self._parse_city,
+            INPUT_CONSTANTS.CITY_TILES: self._parse_city_tile,
+            INPUT_CONSTANTS.ROADS: self._parse_road,
+        }
 
     def _end_turn(self):
         print("D_FINISH")
 
     def _reset_player_states(self):
-        self.players[0].units = []
-        self.players[0].cities = {}
-        self.players[0].city_tile_count = 0
-        self.players[1].units = []
-        self.players[1].cities = {}
-        self.players[1].city_tile_count = 0
+        for player in self.players:
+            player.units = []
+            player.cities = {}
+            player.city_tile_count = 0
+            player._unit_cache = {}
+
+    def _parse_research_points(self, strs):
+        team = int(strs[1])
+        self.players[team].research_points = int(strs[2])
+
+    def _parse_unit(self, strs):
+        team = int(strs[2])
+        x = int(strs[4])
+        y = int(strs[5])
+        self.players[team]._add_unit(int(strs[1]), strs[3], x, y, float(strs[6]), int(strs[7]), int(strs[8]), int(strs[9]))
+        self.map._addUnit(team, x, y)
+
+    def _parse_city(self, strs):
+        team = int(strs[1])
+        self.players[team]._add_city(strs[2], float(strs[3]), float(strs[4]))
+
+    def _parse_city_tile(self, strs):
+        team = int(strs[1])
+        x = int(strs[3])
+        y = int(strs[4])
+        player = self.players[team]
+        citytile = player.cities[strs[2]]._add_city_tile(x, y, float(strs[5]))
+        self.map._setCityTile(citytile, x, y)
+        player.city_tile_count += 1
+
+    def _parse_road(self, strs):
+        self.map._setRoad(int(strs[1]), int(strs[2]), float(strs[3]))
 
     def _update(self, messages):
         """
-        update state
+        update state, returns the number of lines of each record type that were read
         """
-        self.map = GameMap(self.map_width, self.map_height)
+        if self.incremental:
+            self.map._begin_update()
+            for player in self.players:
+                player._begin_update()
+        else:
+            self.map = GameMap(self.map_width, self.map_height)
+            self._reset_player_states()
         self.turn += 1
-        self._reset_player_states()
+
+        parsers = self._parsers
+        counts = dict.fromkeys(parsers, 0)
+        r_types, xs, ys, amounts = [], [], [], []
 
         for update in messages:
-            if update == "D_DONE":
+            if update == INPUT_CONSTANTS.DONE:
                 break
             strs = update.split(" ")
             input_identifier = strs[0]
-            if input_identifier == INPUT_CONSTANTS.RESEARCH_POINTS:
-                team = int(strs[1])
-                self.players[team].research_points = int(strs[2])
-            elif input_identifier == INPUT_CONSTANTS.RESOURCES:
-                r_type = strs[1]
-                x = int(strs[2])
-                y = int(strs[3])
-                amt = int(float(strs[4]))
-                self.map._setResource(r_type, x, y, amt)
-            elif input_identifier == INPUT_CONSTANTS.UNITS:
-                unittype = int(strs[1])
-                team = int(strs[2])
-                unitid = strs[3]
-                x = int(strs[4])
-                y = int(strs[5])
-                cooldown = float(strs[6])
-                wood = int(strs[7])
-                coal = int(strs[8])
-                uranium = int(strs[9])
-                self.players[team].units.append(Unit(team, unittype, unitid, x, y, cooldown, wood, coal, uranium))
-            elif input_identifier == INPUT_CONSTANTS.CITY:
-                team = int(strs[1])
-                cityid = strs[2]
-                fuel = float(strs[3])
-                lightupkeep = float(strs[4])
-                self.players[team].cities[cityid] = City(team, cityid, fuel, lightupkeep)
-            elif input_identifier == INPUT_CONSTANTS.CITY_TILES:
-                team = int(strs[1])
-                cityid = strs[2]
-                x = int(strs[3])
-                y = int(strs[4])
-                cooldown = float(strs[5])
-                city = self.players[team].cities[cityid]
-                citytile = city._add_city_tile(x, y, cooldown)
-                self.map.get_cell(x, y).citytile = citytile
-                self.players[team].city_tile_count += 1;
-            elif input_identifier == INPUT_CONSTANTS.ROADS:
-                x = int(strs[1])
-                y = int(strs[2])
-                road = float(strs[3])
-                self.map.get_cell(x, y).road = road
+            if input_identifier == INPUT_CONSTANTS.RESOURCES:
+                r_types.append(strs[1])
+                xs.append(strs[2])
+                ys.append(strs[3])
+                amounts.append(strs[4])
+                continue
+            parser = parsers.get(input_identifier)
+            if parser is not None:
+                parser(strs)
+                counts[input_identifier] += 1
+
+        self.map._setResources(r_types, xs, ys, amounts)
+        counts[INPUT_CONSTANTS.RESOURCES] = len(r_types)
+
+        if self.incremental:
+            self.map._end_update()
+            for player in self.players:
+                player._end_update()
+
+        return counts
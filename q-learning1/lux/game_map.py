@@ -1,21 +1,34 @@
 import math
-from typing import List
+from typing import Dict, List, NamedTuple
+
+import numpy as np
 
 from .constants import Constants
 
 DIRECTIONS = Constants.DIRECTIONS
 RESOURCE_TYPES = Constants.RESOURCE_TYPES
 
+# Codes used in GameMap.resource_type, 0 means no resource
+RESOURCE_CODES = {
+    RESOURCE_TYPES.WOOD: 1,
+    RESOURCE_TYPES.COAL: 2,
+    RESOURCE_TYPES.URANIUM: 3,
+}
+
 
 class Resource:
+    __slots__ = ("type", "amount")
+
     def __init__(self, r_type: str, amount: int):
         self.type = r_type
         self.amount = amount
 
 
 class Cell:
+    __slots__ = ("pos", "resource", "citytile", "road")
+
     def __init__(self, x, y):
-        self.pos = Position(x, y)
+        self.pos = intern_position(x, y)
         self.resource: Resource = None
         self.citytile = None
         self.road = 0
@@ -27,11 +40,26 @@ class GameMap:
     def __init__(self, width, height):
         self.height = height
         self.width = width
+        self.positions = PositionTable.for_map(width, height)
         self.map: List[List[Cell]] = [None] * height
         for y in range(0, self.height):
             self.map[y] = [None] * width
             for x in range(0, self.width):
                 self.map[y][x] = Cell(x, y)
+        # Cells holding per-turn state, so an incremental update only has to clear these
+        self._resource_cells = set()
+        self._prev_resource_cells = set()
+        self._citytile_cells = []
+        self._road_cells = []
+        self.depleted: List[Position] = []     # Positions whose resource ran out during the last incremental update
+
+        # Array view of the map, indexed [y, x] like self.map
+        self.resource_type = np.zeros((height, width), dtype=np.int8)       # RESOURCE_CODES
+        self.resource_amount = np.zeros((height, width), dtype=np.int32)
+        self.citytile_team = np.full((height, width), -1, dtype=np.int8)    # -1 if no city tile
+        self.citytile_city = np.full((height, width), -1, dtype=np.int32)   # Number from the "c_<n>" city id
+        self.road = np.zeros((height, width), dtype=np.float32)
+        self.unit_count = np.zeros((2, height, width), dtype=np.int16)     # Units per team on each cell
 
     def get_cell_by_pos(self, pos) -> Cell:
         return self.map[pos.y][pos.x]
@@ -39,18 +67,139 @@ class GameMap:
     def get_cell(self, x, y) -> Cell:
         return self.map[y][x]
 
+    def get_pos(self, x, y) -> 'Position':
+        return self.positions.grid[y][x]
+
+    def get_neighbours(self, pos) -> List['Position']:
+        """
+        In-bounds positions adjacent to pos
+        """
+        return self.positions.neighbours[pos]
+
+    def in_bounds(self, pos) -> bool:
+        return self.positions.is_in_bounds(pos)
+
     def _setResource(self, r_type, x, y, amount):
         """
         do not use this function, this is for internal tracking of state
         """
         cell = self.get_cell(x, y)
-        cell.resource = Resource(r_type, amount)
+        if cell.resource is None:
+            cell.resource = Resource(r_type, amount)
+        else:
+            cell.resource.type = r_type
+            cell.resource.amount = amount
+        self._resource_cells.add(cell)
+        if amount > 0:
+            self.resource_type[y, x] = RESOURCE_CODES[r_type]
+            self.resource_amount[y, x] = amount
+
+    def _setResources(self, r_types, xs, ys, amounts):
+        """
+        do not use this function, sets all resources of a turn at once from the raw strings of the update lines
+        """
+        xs = np.array(xs, dtype=np.int32)
+        ys = np.array(ys, dtype=np.int32)
+        amounts = np.array(amounts, dtype=np.float64).astype(np.int32)
+        codes = np.array([RESOURCE_CODES[r_type] for r_type in r_types], dtype=np.int8)
+        present = amounts > 0
+        self.resource_type[ys[present], xs[present]] = codes[present]
+        self.resource_amount[ys[present], xs[present]] = amounts[present]
 
+        rows = self.map
+        resource_cells = self._resource_cells
+        for r_type, x, y, amount in zip(r_types, xs.tolist(), ys.tolist(), amounts.tolist()):
+            cell = rows[y][x]
+            if cell.resource is None:
+                cell.resource = Resource(r_type, amount)
+            else:
+                cell.resource.type = r_type
+                cell.resource.amount = amount
+            resource_cells.add(cell)
 
-class Position:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+    def _setCityTile(self, citytile, x, y):
+        """
+        do not use this function, this is for internal tracking of state
+        """
+        cell = self.get_cell(x, y)
+        cell.citytile = citytile
+        self._citytile_cells.append(cell)
+        self.citytile_team[y, x] = citytile.team
+        self.citytile_city[y, x] = int(citytile.cityid[2:])
+
+    def _setRoad(self, x, y, road):
+        """
+        do not use this function, this is for internal tracking of state
+        """
+        cell = self.get_cell(x, y)
+        cell.road = road
+        self._road_cells.append(cell)
+        self.road[y, x] = road
+
+    def _addUnit(self, team, x, y):
+        """
+        do not use this function, this is for internal tracking of state
+        """
+        self.unit_count[team, y, x] += 1
+
+    def _begin_update(self):
+        """
+        do not use this function, clears the mutable cell state before an incremental update
+        """
+        for cell in self._citytile_cells:
+            cell.citytile = None
+        for cell in self._road_cells:
+            cell.road = 0
+        self._citytile_cells.clear()
+        self._road_cells.clear()
+        self._prev_resource_cells, self._resource_cells = self._resource_cells, self._prev_resource_cells
+        self._resource_cells.clear()
+        self.resource_type.fill(0)
+        self.resource_amount.fill(0)
+        self.citytile_team.fill(-1)
+        self.citytile_city.fill(-1)
+        self.road.fill(0)
+        self.unit_count.fill(0)
+
+    def _end_update(self):
+        """
+        do not use this function, drops resources that were not reported this turn
+        """
+        self.depleted = []
+        for cell in self._prev_resource_cells - self._resource_cells:
+            cell.resource = None
+            self.depleted.append(cell.pos)
+
+    def resource_mask(self, r_type=None):
+        """
+        Boolean grid of cells holding a resource, of r_type if given
+        """
+        if r_type is None:
+            return self.resource_type > 0
+        return self.resource_type == RESOURCE_CODES[r_type]
+
+    def empty_mask(self):
+        """
+        Boolean grid of cells with neither a resource nor a city tile
+        """
+        return (self.resource_type == 0) & (self.citytile_team < 0)
+
+    def occupied_mask(self, team=None):
+        """
+        Boolean grid of cells with at least one unit on them, of team if given
+        """
+        if team is None:
+            return self.unit_count.sum(axis=0) > 0
+        return self.unit_count[team] > 0
+
+
+class Position(NamedTuple):
+    """
+    Immutable and hashable, so positions can be used directly as dict keys and set members.
+    Backed by a tuple, which is as compact as a slotted object and hashes in C
+    """
+    x: int
+    y: int
 
     def __sub__(self, pos) -> int:
         return abs(pos.x - self.x) + abs(pos.y - self.y)
@@ -64,13 +213,14 @@ class Position:
     def is_adjacent(self, pos):
         return (self - pos) <= 1
 
-    def __eq__(self, pos) -> bool:
-        return self.x == pos.x and self.y == pos.y
-
     def equals(self, pos):
         return self == pos
 
     def translate(self, direction, units) -> 'Position':
+        if units == 1:
+            steps = _STEPS.get(self)
+            if steps is not None:
+                return steps[direction]
         if direction == DIRECTIONS.NORTH:
             return Position(self.x, self.y - units)
         elif direction == DIRECTIONS.EAST:
@@ -86,21 +236,90 @@ class Position:
         """
         Return closest position to target_pos from this position
         """
-        check_dirs = [
-            DIRECTIONS.NORTH,
-            DIRECTIONS.EAST,
-            DIRECTIONS.SOUTH,
-            DIRECTIONS.WEST,
-        ]
-        closest_dist = self.distance_to(target_pos)
-        closest_dir = DIRECTIONS.CENTER
-        for direction in check_dirs:
-            newpos = self.translate(direction, 1)
-            dist = target_pos.distance_to(newpos)
-            if dist < closest_dist:
-                closest_dir = direction
-                closest_dist = dist
-        return closest_dir
+        # Any step that gets closer does so by exactly one, so the first of north, east,
+        # south and west that reduces the distance is the closest
+        if target_pos.y < self.y:
+            return DIRECTIONS.NORTH
+        if target_pos.x > self.x:
+            return DIRECTIONS.EAST
+        if target_pos.y > self.y:
+            return DIRECTIONS.SOUTH
+        if target_pos.x < self.x:
+            return DIRECTIONS.WEST
+        return DIRECTIONS.CENTER
 
     def __str__(self) -> str:
         return f"({self.x}, {self.y})"
+
+    __repr__ = __str__
+
+
+
+# Every Position created through a PositionTable, keyed by itself so lookups can also be made with (x, y)
+_INTERNED: Dict[Position, Position] = {}
+# Interned position one step away in each direction, for Position.translate
+_STEPS: Dict[Position, Dict[str, Position]] = {}
+
+
+def intern_position(x, y) -> Position:
+    """
+    Returns the shared Position for (x, y), or a new one if no table covers it
+    """
+    pos = _INTERNED.get((x, y))
+    if pos is None:
+        return Position(x, y)
+    return pos
+
+
+class PositionTable:
+    """
+    Interned Position instances of a width x height map, plus the in-bounds neighbours of each of them.
+    Positions one step off the map are interned too, so translating a position on the map never allocates
+    """
+    _tables: Dict[tuple, 'PositionTable'] = {}
+
+    @classmethod
+    def for_map(cls, width, height) -> 'PositionTable':
+        table = cls._tables.get((width, height))
+        if table is None:
+            table = cls(width, height)
+            cls._tables[(width, height)] = table
+        return table
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+        self.in_bounds: Dict[Position, bool] = {}
+        self.neighbours: Dict[Position, List[Position]] = {}
+        for y in range(-1, height + 1):
+            for x in range(-1, width + 1):
+                pos = _INTERNED.get((x, y))
+                if pos is None:
+                    pos = Position(x, y)
+                    _INTERNED[pos] = pos
+                self.in_bounds[pos] = 0 <= x < width and 0 <= y < height
+        self.grid: List[List[Position]] = [[_INTERNED[(x, y)] for x in range(width)] for y in range(height)]
+
+        for row in self.grid:
+            for pos in row:
+                x, y = pos
+                east, south, west, north = _INTERNED[(x + 1, y)], _INTERNED[(x, y + 1)], _INTERNED[(x - 1, y)], _INTERNED[(x, y - 1)]
+                _STEPS[pos] = {
+                    DIRECTIONS.NORTH: north,
+                    DIRECTIONS.EAST: east,
+                    DIRECTIONS.SOUTH: south,
+                    DIRECTIONS.WEST: west,
+                    DIRECTIONS.CENTER: pos,
+                }
+                # Same order the agents have always searched neighbours in
+                self.neighbours[pos] = [step for step in (east, south, west, north) if self.in_bounds[step]]
+
+    def get(self, x, y) -> Position:
+        return self.grid[y][x]
+
+    def is_in_bounds(self, pos) -> bool:
+        in_bounds = self.in_bounds.get(pos)
+        if in_bounds is None:
+            return 0 <= pos.x < self.width and 0 <= pos.y < self.height
+        return in_bounds
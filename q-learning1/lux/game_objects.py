@@ -1,7 +1,7 @@
 from typing import Dict
 
 from .constants import Constants
-from .game_map import Position
+from .game_map import Position, intern_position
 from .game_constants import GAME_CONSTANTS
 
 UNIT_TYPES = Constants.UNIT_TYPES
@@ -14,6 +14,42 @@ class Player:
         self.units: list[Unit] = []
         self.cities: Dict[str, City] = {}
         self.city_tile_count = 0
+        self._unit_cache: Dict[str, Unit] = {}
+        self._seen_cities = set()
+    def _begin_update(self):
+        """
+        do not use this function, clears the mutable player state before an incremental update
+        """
+        self.units.clear()
+        self.city_tile_count = 0
+        self._seen_cities.clear()
+    def _add_unit(self, u_type, unitid, x, y, cooldown, wood, coal, uranium):
+        unit = self._unit_cache.get(unitid)
+        if unit is None:
+            unit = Unit(self.team, u_type, unitid, x, y, cooldown, wood, coal, uranium)
+            self._unit_cache[unitid] = unit
+        else:
+            unit._set(x, y, cooldown, wood, coal, uranium)
+        self.units.append(unit)
+        return unit
+    def _add_city(self, cityid, fuel, light_upkeep):
+        city = self.cities.get(cityid)
+        if city is None:
+            city = City(self.team, cityid, fuel, light_upkeep)
+            self.cities[cityid] = city
+        else:
+            city._set(fuel, light_upkeep)
+        self._seen_cities.add(cityid)
+        return city
+    def _end_update(self):
+        """
+        do not use this function, drops the units and cities that were not reported this turn
+        """
+        if len(self._unit_cache) != len(self.units):
+            self._unit_cache = {unit.id: unit for unit in self.units}
+        if len(self.cities) != len(self._seen_cities):
+            for cityid in [cityid for cityid in self.cities if cityid not in self._seen_cities]:
+                self.cities.pop(cityid)
     def researched_coal(self) -> bool:
         return self.research_points >= GAME_CONSTANTS["PARAMETERS"]["RESEARCH_REQUIREMENTS"]["COAL"]
     def researched_uranium(self) -> bool:
@@ -27,8 +63,20 @@ class City:
         self.fuel = fuel
         self.citytiles: list[CityTile] = []
         self.light_upkeep = light_upkeep
+        self._tile_cache: Dict[tuple, CityTile] = {}
+    def _set(self, fuel, light_upkeep):
+        self.fuel = fuel
+        self.light_upkeep = light_upkeep
+        if len(self._tile_cache) != len(self.citytiles):
+            self._tile_cache = {(tile.pos.x, tile.pos.y): tile for tile in self.citytiles}
+        self.citytiles.clear()
     def _add_city_tile(self, x, y, cooldown):
-        ct = CityTile(self.team, self.cityid, x, y, cooldown)
+        ct = self._tile_cache.get((x, y))
+        if ct is None:
+            ct = CityTile(self.team, self.cityid, x, y, cooldown)
+            self._tile_cache[(x, y)] = ct
+        else:
+            ct.cooldown = cooldown
         self.citytiles.append(ct)
         return ct
     def get_light_upkeep(self):
@@ -36,10 +84,12 @@ class City:
 
 
 class CityTile:
+    __slots__ = ("cityid", "team", "pos", "cooldown")
+
     def __init__(self, teamid, cityid, x, y, cooldown):
         self.cityid = cityid
         self.team = teamid
-        self.pos = Position(x, y)
+        self.pos = intern_position(x, y)
         self.cooldown = cooldown
     def can_act(self) -> bool:
         """
@@ -64,6 +114,8 @@ class CityTile:
 
 
 class Cargo:
+    __slots__ = ("wood", "coal", "uranium")
+
     def __init__(self):
         self.wood = 0
         self.coal = 0
@@ -74,8 +126,10 @@ class Cargo:
 
 
 class Unit:
+    __slots__ = ("pos", "team", "id", "type", "cooldown", "cargo")
+
     def __init__(self, teamid, u_type, unitid, x, y, cooldown, wood, coal, uranium):
-        self.pos = Position(x, y)
+        self.pos = intern_position(x, y)
         self.team = teamid
         self.id = unitid
         self.type = u_type
@@ -84,6 +138,13 @@ class Unit:
         self.cargo.wood = wood
         self.cargo.coal = coal
         self.cargo.uranium = uranium
+    def _set(self, x, y, cooldown, wood, coal, uranium):
+        if self.pos.x != x or self.pos.y != y:
+            self.pos = intern_position(x, y)
+        self.cooldown = cooldown
+        self.cargo.wood = wood
+        self.cargo.coal = coal
+        self.cargo.uranium = uranium
     def is_worker(self) -> bool:
         return self.type == UNIT_TYPES.WORKER
 
@@ -20,7 +20,14 @@ settings = {
     "num_explore_turns": 5,
     "train_batch_size": 10,
     "train_interval": 60,
-    "reward_weights": (1, 1, 1, -1, -1, -1, 0.2, -0.2, -0.5)
+    "reward_weights": (1, 1, 1, -1, -1, -1, 0.2, -0.2, -0.5),
+    "replay_capacity": 100000,
+    "target_sync_interval": 100,
+    "target_tau": 0.0,
+    "double_dqn": True,
+    "prioritized_replay": True,
+    "priority_alpha": 0.6,
+    "priority_beta": 0.4
 }
 
 optimizer = Adam(learning_rate=0.2)
@@ -31,6 +38,7 @@ model.add(Dense(55, activation='linear'))
 model.compile(loss='mse', optimizer=optimizer)
 
 rl_agent = RLAgent(agent_name, settings, model)
+rl_agent.replay_buffer.reset()
 
 train_agent(1)
 
@@ -1,6 +1,6 @@
 from typing import Dict
 import sys
-from base_agent import base_agent
+from base_agent import BaseAgent
 if __name__ == "__main__":
     
     def read_input():
@@ -17,6 +17,7 @@ if __name__ == "__main__":
             self.player = player
             # self.updates = []
             # self.step = 0
+    agent = BaseAgent()
     observation = Observation()
     observation["updates"] = []
     observation["step"] = 0
@@ -29,7 +30,7 @@ if __name__ == "__main__":
             player_id = int(observation["updates"][0])
             observation.player = player_id
         if inputs == "D_DONE":
-            actions = base_agent(observation, None)
+            actions = agent(observation, None)
             observation["updates"] = []
             step += 1
             observation["step"] = step
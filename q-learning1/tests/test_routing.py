@@ -0,0 +1,47 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lux.game import Game
+from lux.game_map import GameMap
+from Mine import Mines
+from Pathfinding import PathPlanner
+from WorkerAgent import WorkerAgent
+
+
+def test_worker_routes_around_opponent_city_wall():
+    # Opponent city wall at x=5, y=3..7 between the worker at (4,5) and its destination at (6,5)
+    game_map = GameMap(12, 12)
+    game_map.citytile_team[3:8, 5] = 1
+    planner = PathPlanner(game_map, 0, False)
+    controller = SimpleNamespace(map=game_map, paths=planner)
+
+    worker = WorkerAgent(SimpleNamespace(id="u_1", pos=game_map.get_pos(4, 5)), False)
+    worker.destination = game_map.get_pos(6, 5)
+    step = worker.worker.pos.translate(worker.get_step_direction(controller), 1)
+
+    assert not planner.is_blocked(step, False)
+    assert step.distance_to(worker.destination) >= worker.worker.pos.distance_to(worker.destination)
+    assert worker.get_step_candidates(controller, step) == [step]
+
+
+def test_worker_heads_for_mine_past_opponent_city_on_border():
+    # Wood at (5,5) with an opponent city tile on its border at (4,5), the worker at (3,5) is assigned (6,5)
+    game_state = Game()
+    game_state._initialize(["0", "12 12"])
+    game_state._update(["rp 0 0", "rp 1 0", "r wood 5 5 500", "u 0 0 u_1 3 5 0 0 0 0",
+                        "c 1 c_2 100 23", "ct 1 c_2 4 5 0", "D_DONE"])
+    mines = Mines(game_state, False)
+    planner = PathPlanner(game_state.map, 0, False)
+    controller = SimpleNamespace(map=game_state.map, paths=planner, mines=mines)
+
+    worker = WorkerAgent(game_state.players[0].units[0], False)
+    worker.mine = mines.tile_mines[game_state.map.get_pos(5, 5)]
+    worker.mine.assign_spot(worker.worker, game_state.map.get_pos(6, 5))
+    worker.destination = worker.get_mining_spot()
+    step = worker.worker.pos.translate(worker.get_step_direction(controller), 1)
+
+    assert not planner.is_blocked(step, False)
+    assert worker.get_step_candidates(controller, step)[0] == step
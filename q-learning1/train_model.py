@@ -1,22 +1,25 @@
 import sys
 from RLAgent import *
-from agent import *
-from base_agent import base_agent
-from kaggle_environments import make
+from Rollouts import run_rollouts
+import Timing
 
-def run_matches(num_matches):
-    for i in range(num_matches):
-        env = make("lux_ai_2021", configuration={"seed": 562124210, "loglevel": 1, "annotations": True}, debug=True)
-        steps = env.run([agent, base_agent])
-        print("Match", i + 1, "of", num_matches, "completed")
+def run_matches(num_matches, num_processes):
+    # Matches against the base agent, played num_processes at a time
+    run_rollouts("test", num_matches, num_processes, opponent="base_agent")
+    
 def train_agent(num_sessions, batch_size):
     rl_agent = RLAgent("test")
+    Timing.set_agent("training")
     for i in range(num_sessions):
         rl_agent.train(batch_size)
         print("Training session", i + 1, "of", num_sessions, "completed")
+    Timing.end_match()
 
-num_matches = int(sys.argv[1])
-num_sessions = int(sys.argv[2])
-batch_size = int(sys.argv[3])
-run_matches(num_matches)
-train_agent(num_sessions, batch_size)
\ No newline at end of file
+if __name__ == "__main__":
+    # python train_model.py num_matches num_sessions batch_size [num_processes]
+    num_matches = int(sys.argv[1])
+    num_sessions = int(sys.argv[2])
+    batch_size = int(sys.argv[3])
+    num_processes = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    run_matches(num_matches, num_processes)
+    train_agent(num_sessions, batch_size)